@@ -0,0 +1,409 @@
+"""Benchmarks for the Voxelize processing pipeline
+
+Run with `python benchmark.py <name>`; `python benchmark.py --help` lists them.
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import trimesh
+
+import main
+
+
+def make_test_mesh(subdivisions=6):
+    """Build a sphere with 20 * 4**subdivisions triangles"""
+    return trimesh.creation.icosphere(subdivisions=subdivisions)
+
+
+def timed(func, *args, repeat=3, **kwargs):
+    """Return (best wall time in seconds, last result) over `repeat` runs"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def load_via_tempfile(uploaded_file):
+    """The original loader: write the upload to disk and let trimesh read it back"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.stl') as tmp_file:
+        tmp_file.write(uploaded_file.getvalue())
+        tmp_file_path = tmp_file.name
+    mesh_obj = trimesh.load_mesh(tmp_file_path)
+    os.unlink(tmp_file_path)
+    return mesh_obj
+
+
+def bench_stl_loading(args):
+    """Binary STL: temp-file round trip through trimesh vs in-memory fast path"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    data = mesh_obj.export(file_type='stl')
+    print(f"Binary STL: {len(mesh_obj.faces):,} triangles, {len(data) / 1e6:.1f} MB")
+
+    baseline_time, baseline = timed(load_via_tempfile, io.BytesIO(data))
+    fast_time, fast = timed(main.load_stl_file, io.BytesIO(data))
+
+    print(f"  tempfile + trimesh: {baseline_time:.3f} s ({len(baseline.vertices):,} vertices)")
+    print(f"  fast path:          {fast_time:.3f} s ({len(fast.vertices):,} vertices)")
+    print(f"  speedup:            {baseline_time / fast_time:.1f}x")
+
+
+def bench_ascii_stl_loading(args):
+    """ASCII STL: temp-file round trip through trimesh vs vectorized in-memory parser"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    data = mesh_obj.export(file_type='stl_ascii').encode()
+    print(f"ASCII STL: {len(mesh_obj.faces):,} triangles, {len(data) / 1e6:.1f} MB")
+
+    baseline_time, baseline = timed(load_via_tempfile, io.BytesIO(data))
+    fast_time, fast = timed(main.load_stl_file, io.BytesIO(data))
+
+    print(f"  tempfile + trimesh: {baseline_time:.3f} s ({len(baseline.vertices):,} vertices)")
+    print(f"  fast path:          {fast_time:.3f} s ({len(fast.vertices):,} vertices)")
+    print(f"  speedup:            {baseline_time / fast_time:.1f}x")
+
+
+def bench_precluster(args):
+    """Surface voxelization of a dense mesh with and without triangle pre-clustering"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for resolution in args.resolutions:
+        plain_time, plain = timed(main.voxelize_mesh, mesh_obj, resolution, precluster=False, repeat=1)
+        clustered_time, clustered = timed(main.voxelize_mesh, mesh_obj, resolution, repeat=1)
+        same = plain.shape == clustered.shape and (plain.matrix == clustered.matrix).all()
+        print(f"  resolution {resolution:4d}: trimesh {plain_time:.3f} s, "
+              f"pre-clustered {clustered_time:.3f} s, identical: {same}")
+
+
+def bench_mesh_formats(args):
+    """Binary PLY and OBJ: trimesh's loaders vs the in-memory fast paths"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for file_type in ('ply', 'obj'):
+        data = mesh_obj.export(file_type=file_type)
+        data = data.encode() if isinstance(data, str) else data
+        upload = io.BytesIO(data)
+        upload.name = f"mesh.{file_type}"
+
+        baseline_time, _ = timed(lambda: trimesh.load_mesh(io.BytesIO(data), file_type=file_type))
+        fast_time, _ = timed(main.load_mesh_file, upload)
+        print(f"  {file_type.upper()} ({len(data) / 1e6:.1f} MB): trimesh {baseline_time:.3f} s, "
+              f"fast path {fast_time:.3f} s, speedup {baseline_time / fast_time:.1f}x")
+
+
+def measure_peak(func, *args, **kwargs):
+    """Return (wall time in seconds, peak traced allocation in MB, result) of one call"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def world_voxels(voxel_grid):
+    """Set of filled voxel indices in world grid coordinates (voxel centers at index * pitch)"""
+    origin_index = np.round(voxel_grid.transform[:3, 3] / voxel_grid._pitch).astype(np.int64)
+    return set(map(tuple, voxel_grid.sparse_indices + origin_index))
+
+
+def check_native_superset(args):
+    """Assert the native engine covers every voxel trimesh finds, including faces on half-pitch bounds"""
+    meshes = {
+        'unit box': trimesh.creation.box(),
+        '1x2x3 box': trimesh.creation.box((1, 2, 3)),
+        'cylinder': trimesh.creation.cylinder(radius=0.5, height=1, sections=32),
+        'sphere': make_test_mesh(3),
+    }
+    for name, mesh_obj in meshes.items():
+        for resolution in (33, 51, 101):
+            native = main.voxelize_mesh(mesh_obj, resolution, engine='native')
+            reference = main.voxelize_mesh(mesh_obj, resolution, engine='trimesh', precluster=False)
+            assert tuple(native.shape) == tuple(reference.shape), (name, resolution, native.shape, reference.shape)
+            missing = world_voxels(reference) - world_voxels(native)
+            assert not missing, f"{name} at resolution {resolution}: native misses {len(missing)} trimesh voxels"
+            print(f"  {name:9s} resolution {resolution:3d}: native {native.filled_count:,} voxels "
+                  f"covers trimesh {reference.filled_count:,}")
+
+
+def bench_engines(args):
+    """Surface voxelization: trimesh backend vs native engine, time and peak memory"""
+    check_native_superset(args)
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for resolution in args.resolutions:
+        line = f"  resolution {resolution:4d}:"
+        for engine in args.engines:
+            elapsed, peak, voxel_grid = measure_peak(main.voxelize_mesh, mesh_obj, resolution, engine=engine)
+            line += f" {engine} {elapsed:7.3f} s {peak:8.1f} MB peak ({voxel_grid.filled_count:,} voxels),"
+        print(line.rstrip(','))
+
+
+def bench_solid(args):
+    """Solid fill of a surface grid: ray parity vs ndimage.binary_fill_holes vs trimesh fill()"""
+    from scipy import ndimage
+    
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for resolution in args.resolutions:
+        surface = main.voxelize_mesh(mesh_obj, resolution, engine='native')
+        pitch = surface._pitch
+        origin_index = np.round(surface.transform[:3, 3] / pitch).astype(np.int64)
+        
+        parity_time, parity = timed(main.parity_fill, main.iter_mesh_chunks(mesh_obj, main.NATIVE_CHUNK_TRIANGLES),
+                                    pitch, origin_index, surface.shape, repeat=1)
+        parity = parity | surface.matrix
+        holes_time, holes = timed(ndimage.binary_fill_holes, surface.matrix, repeat=1)
+        trimesh_time, filled = timed(lambda: surface.copy().fill().matrix, repeat=1)
+        print(f"  resolution {resolution:4d} ({parity.sum():,} voxels): parity {parity_time:.3f} s, "
+              f"binary_fill_holes {holes_time:.3f} s, trimesh fill {trimesh_time:.3f} s, "
+              f"agree with binary_fill_holes: {(parity == holes).all()}, with trimesh: {(parity == filled).all()}")
+
+
+def bench_tiled(args):
+    """Native engine in one process vs tiled across worker processes with a shared-memory grid"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles, {os.cpu_count()} CPUs")
+    for resolution in args.resolutions:
+        single_time, single = timed(main.voxelize_mesh, mesh_obj, resolution, engine='native', repeat=1)
+        line = f"  resolution {resolution:4d}: 1 process {single_time:.3f} s,"
+        for workers in args.workers:
+            tiled_time, tiled = timed(main.voxelize_mesh, mesh_obj, resolution, engine='native',
+                                      workers=workers, repeat=1)
+            same = (tiled.matrix == single.matrix).all()
+            line += f" {workers} workers {tiled_time:.3f} s ({single_time / tiled_time:.1f}x, identical: {same}),"
+        print(line.rstrip(','))
+
+
+def bench_packed(args):
+    """Dense boolean vs bit-packed grids: memory, voxel counts and set operations"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for resolution in args.resolutions:
+        surface = main.voxelize_mesh(mesh_obj, resolution, engine='native')
+        solid = main.voxelize_mesh(mesh_obj, resolution, engine='native', mode='solid')
+        packed_surface, packed_solid = main.packed_voxel_grid(surface), main.packed_voxel_grid(solid)
+        
+        dense_count, _ = timed(lambda: int(solid.matrix.sum()))
+        packed_count, _ = timed(lambda: packed_solid.filled_count)
+        dense_diff, _ = timed(lambda: solid.matrix & ~surface.matrix)
+        packed_diff, _ = timed(packed_solid.difference, packed_surface)
+        print(f"  resolution {resolution:4d}: {main.voxel_nbytes(solid) / 2**20:.1f} MB dense, "
+              f"{main.voxel_nbytes(packed_solid) / 2**20:.1f} MB packed; "
+              f"count {dense_count * 1e3:.1f} ms vs {packed_count * 1e3:.1f} ms; "
+              f"difference {dense_diff * 1e3:.1f} ms vs {packed_diff * 1e3:.1f} ms")
+
+
+def bench_octree(args):
+    """Sparse voxel octree: build time, region counts vs dense sums, occupied cells per level"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    rng = np.random.default_rng(0)
+    for resolution in args.resolutions:
+        voxel_grid = main.voxelize_mesh(mesh_obj, resolution, engine='native', mode='solid')
+        matrix = voxel_grid.matrix
+        build_time, octree = timed(main.VoxelOctree, voxel_grid.sparse_indices, voxel_grid.shape, repeat=1)
+        
+        boxes = [np.sort(rng.integers(0, np.array(matrix.shape) + 1, (2, 3)), axis=0) for _ in range(20)]
+        points = voxel_grid.sparse_indices
+        dense_time, dense = timed(lambda: [int(matrix[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]].sum()) for lo, hi in boxes])
+        scan_time, _ = timed(lambda: [int(((points >= lo) & (points < hi)).all(axis=1).sum()) for lo, hi in boxes])
+        octree_time, counts = timed(lambda: [octree.count(lo, hi) for lo, hi in boxes])
+        cells = ', '.join(f"{len(codes):,}" for codes, _ in octree.levels)
+        print(f"  resolution {resolution:4d}: build {build_time:.3f} s, {octree.nbytes / 2**20:.1f} MB; "
+              f"20 region counts: dense slice sums {dense_time * 1e3:.1f} ms, filled-voxel scan "
+              f"{scan_time * 1e3:.1f} ms, octree {octree_time * 1e3:.1f} ms (identical: {dense == counts}); "
+              f"cells per level {cells}")
+
+
+def bench_refine(args):
+    """Resolution slider steps: native engine from scratch vs refined from the previous grid"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    previous = main.voxelize_mesh(mesh_obj, args.resolutions[0], engine='native')
+    for previous_resolution, resolution in zip(args.resolutions, args.resolutions[1:]):
+        full_time, full = timed(main.voxelize_mesh, mesh_obj, resolution, engine='native', repeat=1)
+        refined_time, refined = timed(main.voxelize_mesh, mesh_obj, resolution, engine='native',
+                                      previous=previous, repeat=1)
+        same = (full.matrix == refined.matrix).all()
+        print(f"  {previous_resolution:4d} -> {resolution:4d}: from scratch {full_time:.3f} s, "
+              f"refined {refined_time:.3f} s, saved {full_time - refined_time:+.3f} s, identical: {same}")
+        previous = refined
+
+
+def bench_progressive(args):
+    """Progressive voxelization: time until each pass is ready vs one full-resolution run"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    # Keep nothing in the voxel cache so every pass is computed
+    main.get_voxel_cache().max_bytes = 0
+    for resolution in args.resolutions:
+        full_time, _ = timed(main.voxelize_mesh, mesh_obj, resolution, engine='native', repeat=1)
+        start = time.perf_counter()
+        passes = []
+        for pass_resolution, _ in main.voxelize_progressive(mesh_obj, resolution, engine='native'):
+            passes.append(f"{pass_resolution} at {time.perf_counter() - start:.3f} s")
+        print(f"  resolution {resolution:4d}: single run {full_time:.3f} s; passes " + ", ".join(passes))
+
+
+def bench_budget(args):
+    """Budget mode: resolution picked for a filled-voxel budget vs the voxels actually produced"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for mode in main.VOXEL_MODES:
+        for max_voxels in (10**5, 10**6):
+            for calibrate in (False, True):
+                pick_time, resolution = timed(main.budget_resolution, mesh_obj, max_voxels, mode=mode,
+                                              calibrate=calibrate, engine='native', repeat=1)
+                voxel_grid = main.voxelize_mesh(mesh_obj, resolution, engine='native', mode=mode)
+                print(f"  {mode:7s} budget {max_voxels:9,d} (calibrated: {calibrate!s:5}): resolution {resolution:4d} "
+                      f"in {pick_time:.3f} s, {voxel_grid.filled_count:,} voxels "
+                      f"({voxel_grid.filled_count / max_voxels:.0%} of budget)")
+
+
+def bench_cost(args):
+    """Cost model: predicted runtime, peak memory and voxels vs measured, per engine and mode"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for engine in args.engines:
+        for mode in main.VOXEL_MODES:
+            calibration_time, _ = timed(main.calibrate_cost_model, engine, mode, repeat=1)
+            print(f"  {engine} {mode} (calibrated in {calibration_time:.2f} s)")
+            for resolution in args.resolutions:
+                cost = main.estimate_voxelization_cost(mesh_obj, resolution, mode, engine)
+                seconds, voxel_grid = timed(main.voxelize_mesh, mesh_obj, resolution, engine=engine, mode=mode,
+                                            repeat=1)
+                tracemalloc.start()
+                main.voxelize_mesh(mesh_obj, resolution, engine=engine, mode=mode)
+                peak = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+                print(f"    resolution {resolution:4d}: predicted {cost['seconds']:7.3f} s {cost['peak_mb']:8.1f} MB "
+                      f"{cost['voxels']:11,.0f} voxels | measured {seconds:7.3f} s {peak:8.1f} MB "
+                      f"{voxel_grid.filled_count:11,d} voxels")
+
+
+def bench_exposed(args):
+    """Surface-only 3D view: markers and figure build time with and without interior voxels"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for mode in main.VOXEL_MODES:
+        for resolution in args.resolutions:
+            voxel_grid = main.voxelize_mesh(mesh_obj, resolution, engine='native', mode=mode)
+            extract_time, exposed = timed(main.get_exposed_voxels, voxel_grid, repeat=1)
+            all_time, _ = timed(main.create_voxel_visualization, voxel_grid, surface_only=False, repeat=1)
+            surface_time, _ = timed(main.create_voxel_visualization, voxel_grid, repeat=1)
+            print(f"  {mode:7s} resolution {resolution:4d}: {voxel_grid.filled_count:10,d} voxels -> "
+                  f"{len(exposed):9,d} exposed (extracted in {extract_time:.3f} s); "
+                  f"figure {all_time:.3f} s -> {surface_time:.3f} s")
+
+
+def bench_cubes(args):
+    """Cube rendering: merged-face triangles and build time vs 12 triangles per voxel"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for mode in main.VOXEL_MODES:
+        for resolution in args.resolutions:
+            voxel_grid = main.voxelize_mesh(mesh_obj, resolution, engine='native', mode=mode)
+            build_time, (_, triangles, _, _) = timed(main.get_cube_mesh, voxel_grid, repeat=1)
+            figure_time, _ = timed(main.create_voxel_visualization, voxel_grid, render='Cubes', repeat=1)
+            print(f"  {mode:7s} resolution {resolution:4d}: {voxel_grid.filled_count:10,d} voxels -> "
+                  f"{len(triangles):9,d} triangles ({12 * voxel_grid.filled_count:,} unmerged) "
+                  f"built in {build_time:.3f} s, cached figure in {figure_time:.3f} s")
+
+
+def bench_isosurface(args):
+    """Isosurface rendering: automatic step size, triangles and extraction time per resolution"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for mode in main.VOXEL_MODES:
+        for resolution in args.resolutions:
+            voxel_grid = main.voxelize_mesh(mesh_obj, resolution, engine='native', mode=mode)
+            step_size = main.isosurface_step_size(voxel_grid)
+            tracemalloc.start()
+            extract_time, (_, faces) = timed(main.voxel_isosurface, voxel_grid, step_size, repeat=1)
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            print(f"  {mode:7s} resolution {resolution:4d}: step {step_size}, {len(faces):9,d} triangles "
+                  f"(budget {main.ISOSURFACE_TRIANGLES:,}) in {extract_time:.3f} s, peak {peak:.1f} MB")
+
+
+def legacy_hover_figure(voxel_grid):
+    """The original 3D figure: a Python-built hover string per voxel"""
+    fig = main.create_voxel_visualization(voxel_grid, surface_only=False)
+    x, y, z = fig.data[0].x, fig.data[0].y, fig.data[0].z
+    fig.update_traces(text=[f'Voxel ({i},{j},{k})' for i,j,k in zip(x,y,z)],
+                      hovertemplate='<b>Voxel</b><br>X: %{x}<br>Y: %{y}<br>Z: %{z}<extra></extra>',
+                      hoverinfo=None)
+    return fig
+
+
+def bench_hover(args):
+    """3D figure hover labels: build time and JSON payload with per-voxel strings vs a hover template"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles (all voxels drawn; hover off above {main.HOVER_MAX_POINTS:,})")
+    for resolution in args.resolutions:
+        voxel_grid = main.voxelize_mesh(mesh_obj, resolution, engine='native', mode='solid')
+        for label, build in (('per-voxel text', legacy_hover_figure),
+                             ('hover template', lambda grid: main.create_voxel_visualization(grid, surface_only=False))):
+            build_time, fig = timed(build, voxel_grid, repeat=1)
+            json_time, payload = timed(fig.to_json, repeat=1)
+            print(f"  resolution {resolution:4d} {label:14s}: {voxel_grid.filled_count:10,d} voxels, "
+                  f"built in {build_time:.3f} s, JSON {len(payload) / 2**20:7.1f} MB in {json_time:.3f} s")
+
+
+def bench_max_points(args):
+    """Point-budgeted 3D view: level, markers and figure time per budget, first pass vs cached pyramid"""
+    mesh_obj = make_test_mesh(args.subdivisions)
+    print(f"Mesh: {len(mesh_obj.faces):,} triangles")
+    for resolution in args.resolutions:
+        voxel_grid = main.voxelize_mesh(mesh_obj, resolution, engine='native', mode='solid')
+        print(f"  resolution {resolution}: {voxel_grid.filled_count:,} voxels")
+        for attempt in ('first', 'cached'):
+            for max_points in (10**6, 10**5, 10**4, 10**3):
+                figure_time, fig = timed(main.create_voxel_visualization, voxel_grid, max_points=max_points, repeat=1)
+                print(f"    {attempt:6s} max points {max_points:9,d}: {len(fig.data[0].x):9,d} markers of size "
+                      f"{fig.data[0].marker.size:3d} in {figure_time:.3f} s")
+
+
+BENCHMARKS = {
+    'stl-loading': bench_stl_loading,
+    'ascii-stl-loading': bench_ascii_stl_loading,
+    'precluster': bench_precluster,
+    'mesh-formats': bench_mesh_formats,
+    'engines': bench_engines,
+    'native-superset': check_native_superset,
+    'solid': bench_solid,
+    'tiled': bench_tiled,
+    'packed': bench_packed,
+    'octree': bench_octree,
+    'refine': bench_refine,
+    'progressive': bench_progressive,
+    'budget': bench_budget,
+    'cost': bench_cost,
+    'exposed': bench_exposed,
+    'cubes': bench_cubes,
+    'isosurface': bench_isosurface,
+    'hover': bench_hover,
+    'max-points': bench_max_points,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--subdivisions', type=int, default=7,
+                        help="Icosphere subdivisions for the synthetic test mesh")
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[10, 25, 50, 100, 200],
+                        help="Voxel resolutions to benchmark")
+    parser.add_argument('--engines', nargs='+', choices=main.VOXEL_ENGINES, default=main.VOXEL_ENGINES,
+                        help="Voxelization engines to benchmark (trimesh needs several GB at resolution 500)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8, 16, 32],
+                        help="Worker process counts for the tiled benchmark")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -4,105 +4,1968 @@ import plotly.graph_objects as go
 import plotly.express as px
 from stl import mesh
 import trimesh
-from scipy import ndimage
+from scipy import ndimage, optimize
 from skimage import measure
-import tempfile
 import os
+import io
+import hashlib
+import time
+import threading
+import tracemalloc
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 
-def load_stl_file(uploaded_file):
-    """Load STL file and return trimesh object"""
+# Binary STL layout: 80-byte header, uint32 triangle count, then 50-byte records
+STL_HEADER_SIZE = 84
+STL_RECORD_DTYPE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attributes', '<u2'),
+])
+
+def _upload_buffer(uploaded_file):
+    """Return the upload contents without copying where the file object allows it"""
+    if hasattr(uploaded_file, 'getbuffer'):
+        return uploaded_file.getbuffer()
+    return uploaded_file.getvalue()
+
+# Messages from voxelization running on a background thread, which has no Streamlit context
+_job_messages = threading.local()
+
+def show_message(kind, message):
+    """st.warning/st.error, or record the message for the script thread when running as a background job"""
+    messages = getattr(_job_messages, 'messages', None)
+    if messages is None:
+        getattr(st, kind)(message)
+    else:
+        messages.append((kind, message))
+
+def parse_binary_stl(data):
+    """Return (n, 3, 3) float32 triangles viewed from binary STL bytes, or None if not binary"""
+    if len(data) < STL_HEADER_SIZE:
+        return None
+    triangle_count = int(np.frombuffer(data, dtype='<u4', count=1, offset=80)[0])
+    # ASCII files (and some binary ones) start with "solid", so trust the size check instead
+    if len(data) != STL_HEADER_SIZE + triangle_count * STL_RECORD_DTYPE.itemsize:
+        return None
+    records = np.frombuffer(data, dtype=STL_RECORD_DTYPE, count=triangle_count, offset=STL_HEADER_SIZE)
+    return records['vertices']
+
+def _gather_ranges(buf, starts, ends):
+    """Concatenate the non-overlapping byte ranges buf[start:end] without a Python loop"""
+    marks = np.zeros(len(buf) + 1, dtype=np.int8)
+    marks[starts] = 1
+    marks[np.minimum(ends, len(buf))] -= 1
+    return buf[np.cumsum(marks[:-1], dtype=np.int8) > 0]
+
+def parse_ascii_stl(data):
+    """Return (n, 3, 3) float64 triangles from ASCII STL bytes, or None if they can't be parsed"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    
+    # Locate every case-insensitive "vertex" keyword that starts a token
+    candidates = np.flatnonzero((buf[:-6] | 0x20) == ord('v'))
+    is_keyword = (candidates == 0) | (buf[np.maximum(candidates - 1, 0)] <= 32)
+    for offset, char in enumerate(b'ertex', start=1):
+        is_keyword &= (buf[candidates + offset] | 0x20) == char
+    is_keyword &= buf[candidates + 6] <= 32
+    starts = candidates[is_keyword] + 6
+    if len(starts) == 0 or len(starts) % 3 != 0:
+        return None
+    
+    # Each coordinate run ends at the newline closing its vertex line
+    newlines = np.flatnonzero(buf == ord('\n'))
+    line_ends = np.append(newlines, len(buf))[np.searchsorted(newlines, starts)]
+    
+    # Keep only the coordinate text (plus its newline) and parse it in one pass
     try:
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.stl') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_file_path = tmp_file.name
+        values = np.fromstring(_gather_ranges(buf, starts, line_ends + 1).tobytes(),
+                               dtype=np.float64, sep=' ')
+    except ValueError:
+        return None
+    if len(values) != len(starts) * 3:
+        return None
+    return values.reshape(-1, 3, 3)
+
+def _unique_keys(keys):
+    """Return (first index, inverse) of each unique value in a 1D key array using one sort"""
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    starts = np.empty(len(keys), dtype=bool)
+    starts[:1] = True
+    np.not_equal(sorted_keys[1:], sorted_keys[:-1], out=starts[1:])
+    inverse = np.empty(len(keys), dtype=np.int64)
+    inverse[order] = np.cumsum(starts) - 1
+    return order[starts], inverse
+
+def _mix64(keys):
+    """Scramble 64-bit keys with the splitmix64 finalizer"""
+    keys = keys ^ (keys >> np.uint64(30))
+    keys *= np.uint64(0xBF58476D1CE4E5B9)
+    keys ^= keys >> np.uint64(27)
+    keys *= np.uint64(0x94D049BB133111EB)
+    keys ^= keys >> np.uint64(31)
+    return keys
+
+# Corners closer than this are merged when loading (0 welds bitwise-identical corners only)
+WELD_TOLERANCE = 0.0
+
+def weld_vertices(triangles, tolerance=0.0):
+    """Merge triangle soup corners that share a tolerance-sized cell into shared vertices"""
+    # Adding 0.0 copies out of the upload buffer and folds -0.0 into 0.0
+    points = np.ascontiguousarray(triangles.reshape(-1, 3)) + triangles.dtype.type(0.0)
+    
+    if tolerance > 0:
+        # Quantize to the tolerance grid; corners in the same cell weld together
+        rows = np.floor(points / tolerance + 0.5).astype(np.int64)
+        rows -= rows.min(axis=0)
+        bits = rows.view(np.uint64)
+    else:
+        rows = points
+        bits = points.view(np.uint32 if points.dtype.itemsize == 4 else np.uint64).astype(np.uint64)
+    
+    if tolerance > 0 and rows.max(initial=0) < 2**21:
+        # Three 21-bit cell indices pack into one 64-bit key without collisions
+        keys = (bits[:, 0] << np.uint64(42)) | (bits[:, 1] << np.uint64(21)) | bits[:, 2]
+        index, inverse = _unique_keys(keys)
+    else:
+        # Otherwise hash each row into one 64-bit key
+        keys = _mix64(bits[:, 0])
+        keys = _mix64(keys ^ bits[:, 1])
+        keys = _mix64(keys ^ bits[:, 2])
+        index, inverse = _unique_keys(keys)
         
-        # Load with trimesh
-        mesh_obj = trimesh.load_mesh(tmp_file_path)
+        # A hash collision would merge distinct rows, so fall back to exact row keys
+        if not (rows[index][inverse] == rows).all():
+            row_keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * 3))).ravel()
+            _, index, inverse = np.unique(row_keys, return_index=True, return_inverse=True)
+    
+    vertices = points[index].astype(np.float64)
+    faces = inverse.reshape(-1, 3)
+    return vertices, faces
+
+def _mesh_from_triangles(triangles, weld_tolerance):
+    """Weld a triangle soup into a trimesh object, recording the welding statistics"""
+    start = time.perf_counter()
+    vertices, faces = weld_vertices(triangles, weld_tolerance)
+    weld_seconds = time.perf_counter() - start
+    
+    mesh_obj = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+    mesh_obj.metadata['weld'] = {
+        'corners': faces.size,
+        'vertices': len(vertices),
+        'merged': faces.size - len(vertices),
+        'tolerance': weld_tolerance,
+        'seconds': weld_seconds,
+    }
+    return mesh_obj
+
+def load_stl_file(uploaded_file, weld_tolerance=WELD_TOLERANCE):
+    """Load STL file and return trimesh object"""
+    try:
+        data = _upload_buffer(uploaded_file)
         
-        # Clean up temp file
-        os.unlink(tmp_file_path)
+        # Fast path: read binary triangle records straight from the upload buffer,
+        # or pull ASCII vertex coordinates out with vectorized byte operations
+        triangles = parse_binary_stl(data)
+        if triangles is None:
+            triangles = parse_ascii_stl(data)
+        if triangles is not None and np.isfinite(triangles).all():
+            return _mesh_from_triangles(triangles, weld_tolerance)
         
-        return mesh_obj
+        # Malformed files go through trimesh's generic loader
+        return trimesh.load_mesh(io.BytesIO(bytes(data)), file_type='stl')
     except Exception as e:
         st.error(f"Error loading STL file: {str(e)}")
         return None
 
-def voxelize_mesh(mesh_obj, resolution=50):
-    """Convert mesh to voxel representation"""
+# Mesh formats accepted by the uploader
+MESH_FILE_TYPES = ['stl', 'ply', 'obj']
+
+# PLY scalar type names mapped to NumPy type codes
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+def _fan_triangulate(corners, counts=None):
+    """Split polygons into (m, 3) triangle fans
+    
+    corners is either an (n, k) array of fixed-size polygons, or a flat index
+    array holding consecutive polygons whose sizes are given by counts.
+    """
+    if counts is None:
+        size = corners.shape[1]
+        return np.column_stack([
+            np.repeat(corners[:, 0], size - 2),
+            corners[:, 1:-1].ravel(),
+            corners[:, 2:].ravel(),
+        ])
+    
+    offsets = np.cumsum(counts) - counts
+    triangle_counts = counts - 2
+    first = np.repeat(offsets, triangle_counts)
+    step = np.arange(triangle_counts.sum()) - np.repeat(np.cumsum(triangle_counts) - triangle_counts, triangle_counts)
+    return np.column_stack([corners[first], corners[first + step + 1], corners[first + step + 2]])
+
+def parse_binary_ply(data):
+    """Return (vertices, faces) viewed from binary PLY bytes, or None if the fast path doesn't apply"""
+    head = bytes(data[:65536])
+    end = head.find(b'end_header')
+    if not head.startswith(b'ply') or end < 0:
+        return None
+    offset = head.index(b'\n', end) + 1
+    
+    # Parse the header into elements and their properties
+    byte_order = None
+    elements = []
+    for line in head[:end].decode('ascii', 'replace').splitlines():
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] == 'format':
+            byte_order = {'binary_little_endian': '<', 'binary_big_endian': '>'}.get(tokens[1])
+        elif tokens[0] == 'element':
+            elements.append((tokens[1], int(tokens[2]), []))
+        elif tokens[0] == 'property' and elements:
+            elements[-1][2].append(tokens[1:])
+    if byte_order is None:
+        return None
+    
+    vertices = corners = None
+    for name, count, properties in elements:
+        # Every record of an element must have the same size to be viewed as a structured array,
+        # so list properties are only supported as face corner lists of one fixed length
+        fields = []
+        corner_count = None
+        for prop in properties:
+            if prop[0] != 'list':
+                fields.append((prop[1], byte_order + PLY_TYPES[prop[0]]))
+                continue
+            if name != 'face' or prop[3] not in ('vertex_indices', 'vertex_index') or corner_count is not None:
+                return None
+            count_type = byte_order + PLY_TYPES[prop[1]]
+            count_offset = offset + np.dtype(fields).itemsize if fields else offset
+            if count == 0 or count_offset >= len(data):
+                return None
+            corner_count = int(np.frombuffer(data, dtype=count_type, count=1, offset=count_offset)[0])
+            if corner_count < 3:
+                return None
+            fields.append(('corner_count', count_type))
+            fields.append(('vertex_indices', byte_order + PLY_TYPES[prop[2]], (corner_count,)))
+        
+        record = np.dtype(fields)
+        if offset + count * record.itemsize > len(data):
+            return None
+        records = np.frombuffer(data, dtype=record, count=count, offset=offset)
+        offset += count * record.itemsize
+        
+        if corner_count is not None and (records['corner_count'] != corner_count).any():
+            return None
+        if name == 'vertex':
+            vertices = np.column_stack([records['x'], records['y'], records['z']]).astype(np.float64)
+        elif name == 'face':
+            corners = records['vertex_indices'].astype(np.int64)
+    
+    if vertices is None or corners is None:
+        return None
+    if len(corners) and (corners.min() < 0 or corners.max() >= len(vertices)):
+        return None
+    return vertices, _fan_triangulate(corners)
+
+def _line_token_counts(text, line_count):
+    """Count whitespace-separated tokens on each newline-terminated line of a byte array"""
+    is_space = text <= 32
+    token_starts = np.flatnonzero(~is_space & np.concatenate([[True], is_space[:-1]]))
+    line_ids = np.cumsum(text == ord('\n'), dtype=np.int32)[token_starts]
+    return np.bincount(line_ids, minlength=line_count)[:line_count]
+
+def parse_obj(data):
+    """Return (vertices, faces) from OBJ bytes using vectorized tokenization, or None if unsupported"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    # Line continuations would need joining first
+    if len(buf) < 2 or (buf == ord('\\')).any():
+        return None
+    
+    # Classify lines by their keyword: "v " vertices and "f " faces
+    newlines = np.flatnonzero(buf == ord('\n'))
+    line_starts = np.concatenate([[0], newlines + 1])
+    line_ends = np.append(newlines, len(buf))
+    line_starts, line_ends = line_starts[line_starts < len(buf) - 1], line_ends[line_starts < len(buf) - 1]
+    keyword_ends = (buf[line_starts + 1] == ord(' ')) | (buf[line_starts + 1] == ord('\t'))
+    vertex_lines = keyword_ends & (buf[line_starts] == ord('v'))
+    face_lines = keyword_ends & (buf[line_starts] == ord('f'))
+    if not vertex_lines.any() or not face_lines.any():
+        return None
+    
     try:
+        # Vertex lines may carry extra values (w or colors), but all must carry the same number
+        text = _gather_ranges(buf, line_starts[vertex_lines] + 2, line_ends[vertex_lines] + 1)
+        values = np.fromstring(text.tobytes(), dtype=np.float64, sep=' ')
+        value_counts = _line_token_counts(text, vertex_lines.sum())
+        if value_counts.min() < 3 or value_counts.min() != value_counts.max():
+            return None
+        vertices = values.reshape(len(value_counts), -1)[:, :3]
+        
+        # Face corners look like v, v/vt, v//vn or v/vt/vn: blank everything from the first slash
+        text = _gather_ranges(buf, line_starts[face_lines] + 2, line_ends[face_lines] + 1).copy()
+        is_space = text <= 32
+        slashes = np.cumsum(text == ord('/'), dtype=np.int32)
+        slashes_before_token = np.maximum.accumulate(np.where(is_space, slashes, 0))
+        text[(slashes > slashes_before_token) & ~is_space] = ord(' ')
+        indices = np.fromstring(text.tobytes(), dtype=np.int64, sep=' ')
+        corner_counts = _line_token_counts(text, face_lines.sum())
+    except ValueError:
+        return None
+    
+    # Relative (negative) indices and degenerate polygons go through trimesh instead
+    if len(indices) != corner_counts.sum() or corner_counts.min() < 3 or indices.min() < 1:
+        return None
+    if indices.max() > len(vertices):
+        return None
+    return np.ascontiguousarray(vertices), _fan_triangulate(indices - 1, corner_counts)
+
+def load_mesh_file(uploaded_file, weld_tolerance=WELD_TOLERANCE):
+    """Load an STL, PLY or OBJ upload and return trimesh object"""
+    file_type = os.path.splitext(getattr(uploaded_file, 'name', ''))[1].lower().lstrip('.')
+    if file_type not in ('ply', 'obj'):
+        return load_stl_file(uploaded_file, weld_tolerance)
+    
+    try:
+        data = _upload_buffer(uploaded_file)
+        parsed = parse_binary_ply(data) if file_type == 'ply' else parse_obj(data)
+        if parsed is not None and np.isfinite(parsed[0]).all():
+            vertices, faces = parsed
+            if weld_tolerance > 0:
+                return _mesh_from_triangles(vertices[faces], weld_tolerance)
+            return trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+        
+        # ASCII PLY, polygon lists of mixed sizes and other variants go through trimesh
+        return trimesh.load_mesh(io.BytesIO(bytes(data)), file_type=file_type)
+    except Exception as e:
+        st.error(f"Error loading {file_type.upper()} file: {str(e)}")
+        return None
+
+# Triangles per chunk when streaming STL files from disk (~36 MB of float32 vertices)
+STL_CHUNK_TRIANGLES = 1_000_000
+
+def iter_stl_chunks(path, chunk_size=STL_CHUNK_TRIANGLES):
+    """Yield (n, 3, 3) float32 triangle chunks from a binary STL file on disk"""
+    with open(path, 'rb') as f:
+        header = f.read(STL_HEADER_SIZE)
+    if len(header) < STL_HEADER_SIZE:
+        raise ValueError(f"{path} is too short to be a binary STL file")
+    triangle_count = int(np.frombuffer(header, dtype='<u4', count=1, offset=80)[0])
+    if os.path.getsize(path) != STL_HEADER_SIZE + triangle_count * STL_RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path} is not a binary STL file")
+    
+    for start in range(0, triangle_count, chunk_size):
+        count = min(chunk_size, triangle_count - start)
+        # Map one chunk at a time so its pages are released before the next
+        records = np.memmap(path, dtype=STL_RECORD_DTYPE, mode='r', shape=(count,),
+                            offset=STL_HEADER_SIZE + start * STL_RECORD_DTYPE.itemsize)
+        triangles = np.array(records['vertices'])
+        del records
+        yield triangles
+
+def stl_chunk_bounds(chunks):
+    """Return the (2, 3) bounding box of an iterable of triangle chunks"""
+    lower = np.full(3, np.inf)
+    upper = np.full(3, -np.inf)
+    for triangles in chunks:
+        points = triangles.reshape(-1, 3)
+        lower = np.minimum(lower, points.min(axis=0))
+        upper = np.maximum(upper, points.max(axis=0))
+    return np.array([lower, upper])
+
+# Upper bound on memory held by parsed meshes across reruns and sessions
+MESH_CACHE_MAX_MB = float(os.environ.get('VOXELIZE_MESH_CACHE_MB', 2048))
+
+class LRUCache:
+    """Least-recently-used store bounded by the total size of its values"""
+    
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __contains__(self, key):
+        return key in self._items
+    
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+    
+    def get(self, key):
+        """Return the cached value (marking it recently used) or None"""
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key][0]
+    
+    def put(self, key, value, keep=False):
+        """Store a value, evicting the least recently used entries to stay under max_bytes
+        
+        With keep the value is stored even if it alone is over the budget, since
+        it is in use and dropping it would only rebuild it on the next rerun.
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            # Values larger than the whole budget are never kept
+            if size > self.max_bytes and not keep:
+                return
+            while self._items and self.nbytes + size > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.nbytes -= evicted_size
+            self._items[key] = (value, size)
+            self.nbytes += size
+    
+    def refresh(self, value):
+        """Re-measure the entries holding value after it grew, evicting others to stay under max_bytes"""
+        with self._lock:
+            keys = [key for key, (item, _) in self._items.items() if item is value]
+        for key in keys:
+            self.put(key, value, keep=True)
+
+def mesh_nbytes(mesh_obj):
+    """Approximate memory held by a mesh's geometry arrays and the derived arrays trimesh caches on it"""
+    # The statistics threads fill the cache concurrently; dict.copy() runs under the GIL in one step
+    cached = sum(value.nbytes for value in mesh_obj._cache.cache.copy().values() if isinstance(value, np.ndarray))
+    return mesh_obj.vertices.nbytes + mesh_obj.faces.nbytes + cached
+
+@st.cache_resource
+def get_mesh_cache():
+    """Process-wide mesh cache shared by all reruns and sessions"""
+    return LRUCache(int(MESH_CACHE_MAX_MB * 2**20), mesh_nbytes)
+
+def upload_hash(uploaded_file):
+    """Content hash of an upload, computed once per uploaded file per session"""
+    file_id = getattr(uploaded_file, 'file_id', None)
+    known_hashes = st.session_state.setdefault('upload_hashes', {})
+    if file_id is not None and file_id in known_hashes:
+        return known_hashes[file_id]
+    
+    digest = hashlib.blake2b(_upload_buffer(uploaded_file), digest_size=16).hexdigest()
+    if file_id is not None:
+        known_hashes[file_id] = digest
+    return digest
+
+def load_mesh_cached(uploaded_file, weld_tolerance=WELD_TOLERANCE):
+    """Load an upload through the content-hash keyed mesh cache"""
+    cache = get_mesh_cache()
+    key = f"{upload_hash(uploaded_file)}:{weld_tolerance!r}"
+    mesh_obj = cache.get(key)
+    if mesh_obj is None:
+        mesh_obj = load_mesh_file(uploaded_file, weld_tolerance)
+        if mesh_obj is not None:
+            mesh_obj.metadata['content_hash'] = key
+            cache.put(key, mesh_obj)
+    return mesh_obj
+
+def display_cache_info():
+    """Show cache occupancy and hit rate in the sidebar"""
+    with st.sidebar.expander("Cache Statistics"):
+        for label, cache in (("Mesh", get_mesh_cache()), ("Voxel", get_voxel_cache())):
+            st.write(f"**{label} Cache:** {len(cache)} entries, "
+                     f"{cache.nbytes / 2**20:.1f} / {cache.max_bytes / 2**20:.0f} MB")
+            st.write(f"**{label} Hit Rate:** {cache.hit_rate:.1%} ({cache.hits} hits, {cache.misses} misses)")
+        if VOXEL_CACHE_DIR:
+            st.write(f"**Voxel Disk Cache:** `{VOXEL_CACHE_DIR}`")
+
+# Surface voxelization engines selectable in voxelize_mesh
+VOXEL_ENGINES = ['trimesh', 'native']
+VOXEL_ENGINE_HELP = ("trimesh: subdivide triangles and mark the voxels of their vertices. "
+                     "native: exact triangle/voxel overlap tests, faster and lighter at high resolution")
+
+# Voxel grid storage: a dense boolean array, bit-packed bytes, or sorted indices of the filled voxels
+VOXEL_STORAGES = ['dense', 'packed', 'sparse']
+VOXEL_STORAGE_HELP = ("dense: one byte per grid voxel. "
+                      "packed: one bit per grid voxel, 8x smaller than dense. "
+                      "sparse: memory proportional to the filled voxels, for surface grids at high resolution")
+MAX_RESOLUTION = {'dense': 200, 'packed': 400, 'sparse': 2000}
+
+# How the grid size is chosen: directly, or from a filled voxel or memory budget
+GRID_SIZE_MODES = ['Resolution', 'Voxel budget', 'Memory budget']
+
+# Voxelization modes: the surface shell only, or the shell plus its interior
+VOXEL_MODES = ['surface', 'solid']
+VOXEL_MODE_HELP = ("surface: voxels touched by the mesh surface only. "
+                   "solid: also fill the interior, exactly for watertight meshes")
+
+def voxelize_mesh(mesh_obj, resolution=50, precluster=True, engine='trimesh', mode='surface', workers=1,
+                  storage='dense', previous=None):
+    """Convert mesh to voxel representation
+    
+    With the native engine, `previous` may be a coarser grid of the same mesh;
+    only voxels near its surface are then re-tested at the new resolution. It is
+    ignored unless it came from the native engine in the same mode, since other
+    engines can miss voxels the native tests find.
+    """
+    try:
+        if storage == 'sparse' and mode == 'solid':
+            raise ValueError("solid mode is not available with sparse storage, since a filled interior is not sparse")
+        
         # Get mesh bounds
         bounds = mesh_obj.bounds
         
-        # Calculate pitch based on the largest dimension
-        max_dimension = max(bounds[1] - bounds[0])
-        pitch = max_dimension / resolution
+        if previous is not None and (getattr(previous, '_engine', None), getattr(previous, '_mode', None)) != (
+                'native', mode):
+            previous = None
         
-        # Create voxel grid
-        voxel_grid = mesh_obj.voxelized(pitch=pitch)
+        if engine == 'native' and storage != 'dense' and mode == 'surface':
+            # Sparse or packed native engine: hits never pass through a dense boolean grid
+            voxel_grid = voxelize_native(iter_mesh_chunks(mesh_obj, NATIVE_CHUNK_TRIANGLES), bounds, resolution,
+                                         storage=storage)
+        elif engine == 'native' and workers != 1:
+            # Tiled native engine: grid bricks voxelized in parallel worker processes
+            voxel_grid = voxelize_tiled(mesh_obj, bounds, resolution, workers)
+        elif engine == 'native' and previous is not None:
+            # Refinement: voxels away from a coarser grid's surface are skipped before testing
+            candidates = refinement_candidates(previous, bounds, resolution)
+            voxel_grid = voxelize_native(iter_mesh_chunks(mesh_obj, NATIVE_CHUNK_TRIANGLES), bounds, resolution,
+                                         candidates=candidates)
+        elif engine == 'native':
+            # Native engine: exact triangle/box overlap tests in bounded-memory batches
+            voxel_grid = voxelize_native(iter_mesh_chunks(mesh_obj, NATIVE_CHUNK_TRIANGLES), bounds, resolution)
+        elif precluster:
+            # Pre-clustered path: triangles inside a single voxel skip subdivision
+            voxel_grid = voxelize_chunks(iter_mesh_chunks(mesh_obj), bounds, resolution)
+        else:
+            # Calculate pitch based on the largest dimension
+            max_dimension = max(bounds[1] - bounds[0])
+            pitch = max_dimension / resolution
+            
+            # Create voxel grid
+            voxel_grid = mesh_obj.voxelized(pitch=pitch)
+            
+            # Store pitch for later use
+            voxel_grid._pitch = pitch
         
-        # Store pitch for later use
-        voxel_grid._pitch = pitch
+        if mode == 'solid':
+            voxel_grid = fill_voxel_grid(mesh_obj, voxel_grid)
+        if storage == 'sparse':
+            voxel_grid = sparse_voxel_grid(voxel_grid)
+        elif storage == 'packed':
+            voxel_grid = packed_voxel_grid(voxel_grid)
         
+        # Record how the grid was made, so it is only refined from when that is exact
+        voxel_grid._engine = engine
+        voxel_grid._mode = mode
         return voxel_grid
     except Exception as e:
-        st.error(f"Error voxelizing mesh: {str(e)}")
+        show_message('error', f"Error voxelizing mesh: {str(e)}")
         return None
 
-def create_voxel_visualization(voxel_grid, colormap="Viridis", color_by="Z-coordinate", marker_size=4, opacity=0.8):
-    """Create 3D visualization of voxels with customizable colormaps"""
-    # Get filled voxel positions
-    filled_positions = np.argwhere(voxel_grid.matrix)
+def iter_mesh_chunks(mesh_obj, chunk_size=STL_CHUNK_TRIANGLES):
+    """Yield (n, 3, 3) triangle chunks of an in-memory mesh"""
+    for start in range(0, len(mesh_obj.faces), chunk_size):
+        yield mesh_obj.vertices[mesh_obj.faces[start:start + chunk_size]]
+
+def cluster_triangles(triangles, pitch):
+    """Split triangles into the cells of those inside a single voxel and the remaining larger ones"""
+    # A triangle whose corners round to one voxel center lies entirely in that voxel,
+    # so its cell is exactly what subdividing it would have produced
+    cells = np.round(triangles / pitch).astype(np.int64)
+    inside_one = (cells == cells[:, :1]).all(axis=(1, 2))
+    return cells[inside_one, 0], triangles[~inside_one]
+
+def _voxel_grid_from_matrix(matrix, pitch, origin_index):
+    """Wrap a dense occupancy matrix whose voxel (0, 0, 0) sits at origin_index * pitch"""
+    voxel_grid = trimesh.voxel.VoxelGrid(
+        trimesh.voxel.encoding.DenseEncoding(matrix),
+        transform=trimesh.transformations.scale_and_translate(
+            scale=pitch, translate=np.asarray(origin_index) * pitch),
+    )
+    voxel_grid._pitch = pitch
+    return voxel_grid
+
+class SparseVoxelGrid:
+    """Voxel grid stored as the sorted linear indices of its filled voxels
     
-    if len(filled_positions) == 0:
-        st.warning("No voxels found in the mesh")
+    Exposes the parts of trimesh's VoxelGrid interface the app uses, so it can
+    stand in for a dense grid; only `matrix` materializes the full array.
+    """
+    
+    def __init__(self, indices, shape, pitch, origin_index):
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.shape = tuple(int(n) for n in shape)
+        self.origin_index = np.asarray(origin_index, dtype=np.int64)
+        self._pitch = pitch
+    
+    @property
+    def filled_count(self):
+        return len(self.indices)
+    
+    @property
+    def sparse_indices(self):
+        return np.column_stack(np.unravel_index(self.indices, self.shape))
+    
+    @property
+    def transform(self):
+        return trimesh.transformations.scale_and_translate(
+            scale=self._pitch, translate=self.origin_index * self._pitch)
+    
+    @property
+    def matrix(self):
+        matrix = np.zeros(self.shape, dtype=bool)
+        matrix.reshape(-1)[self.indices] = True
+        return matrix
+    
+    def slice(self, axis, index):
+        """Dense 2D occupancy of one grid plane perpendicular to axis"""
+        nx, ny, nz = self.shape
+        if axis == 0:
+            # X planes are contiguous runs of linear indices
+            start, stop = np.searchsorted(self.indices, [index * ny * nz, (index + 1) * ny * nz])
+            plane = self.indices[start:stop] - index * ny * nz
+        elif axis == 1:
+            plane = self.indices[(self.indices // nz) % ny == index]
+            plane = (plane // (ny * nz)) * nz + plane % nz
+        else:
+            plane = self.indices[self.indices % nz == index] // nz
+        
+        plane_shape = [n for i, n in enumerate(self.shape) if i != axis]
+        data = np.zeros(plane_shape, dtype=bool)
+        data.reshape(-1)[plane] = True
+        return data
+    
+    def unpack(self, start=0, stop=None):
+        """Boolean occupancy of X planes start to stop"""
+        nx, ny, nz = self.shape
+        stop = nx if stop is None else min(stop, nx)
+        # X planes are contiguous runs of linear indices
+        first, last = np.searchsorted(self.indices, [start * ny * nz, stop * ny * nz])
+        data = np.zeros((max(stop - start, 0), ny, nz), dtype=bool)
+        data.reshape(-1)[self.indices[first:last] - start * ny * nz] = True
+        return data
+
+# Set bits in each byte value, for popcounts on NumPy versions without bitwise_count
+BYTE_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+class PackedVoxelGrid:
+    """Voxel grid stored 8 voxels per byte, packed along Z as by np.packbits(matrix, axis=2)
+    
+    Counts, slices and set operations work on the packed bytes; `matrix` unpacks
+    the full boolean array on demand.
+    """
+    
+    def __init__(self, packed, shape, pitch, origin_index):
+        self.packed = np.asarray(packed, dtype=np.uint8)
+        self.shape = tuple(int(n) for n in shape)
+        self.origin_index = np.asarray(origin_index, dtype=np.int64)
+        self._pitch = pitch
+    
+    @classmethod
+    def from_matrix(cls, matrix, pitch, origin_index):
+        return cls(np.packbits(matrix, axis=2), matrix.shape, pitch, origin_index)
+    
+    @property
+    def filled_count(self):
+        if hasattr(np, 'bitwise_count'):
+            return int(np.bitwise_count(self.packed).sum(dtype=np.int64))
+        return int(BYTE_POPCOUNT[self.packed].sum(dtype=np.int64))
+    
+    @property
+    def sparse_indices(self):
+        # Unpack a slab of X planes at a time to bound the temporary boolean array
+        step = max(1, (1 << 24) // max(self.shape[1] * self.shape[2], 1))
+        found = [np.argwhere(self.unpack(start, start + step)) + [start, 0, 0]
+                 for start in range(0, self.shape[0], step)]
+        return np.concatenate(found) if found else np.zeros((0, 3), dtype=np.int64)
+    
+    @property
+    def transform(self):
+        return trimesh.transformations.scale_and_translate(
+            scale=self._pitch, translate=self.origin_index * self._pitch)
+    
+    @property
+    def matrix(self):
+        return self.unpack()
+    
+    def unpack(self, start=0, stop=None):
+        """Boolean occupancy of X planes start to stop"""
+        return np.unpackbits(self.packed[start:stop], axis=2, count=self.shape[2]).view(bool)
+    
+    def slice(self, axis, index):
+        """Dense 2D occupancy of one grid plane perpendicular to axis"""
+        if axis == 2:
+            return ((self.packed[:, :, index >> 3] >> (7 - (index & 7))) & 1).view(bool)
+        plane = np.take(self.packed, index, axis=axis)
+        return np.unpackbits(plane, axis=1, count=self.shape[2]).view(bool)
+    
+    def _combine(self, other, op):
+        if not isinstance(other, PackedVoxelGrid):
+            other = packed_voxel_grid(other)
+        if other.shape != self.shape or not np.allclose(other.transform, self.transform):
+            raise ValueError("voxel grids must share shape, pitch and origin")
+        return PackedVoxelGrid(op(self.packed, other.packed), self.shape, self._pitch, self.origin_index)
+    
+    def union(self, other):
+        return self._combine(other, np.bitwise_or)
+    
+    def intersection(self, other):
+        return self._combine(other, np.bitwise_and)
+    
+    def difference(self, other):
+        # Padding bits are zero in both grids, so they stay zero
+        return self._combine(other, lambda a, b: a & ~b)
+
+def packed_voxel_grid(voxel_grid):
+    """Convert any voxel grid to bit-packed storage"""
+    if isinstance(voxel_grid, PackedVoxelGrid):
+        return voxel_grid
+    origin_index = np.round(voxel_grid.transform[:3, 3] / voxel_grid._pitch).astype(np.int64)
+    return PackedVoxelGrid.from_matrix(voxel_grid.matrix, voxel_grid._pitch, origin_index)
+
+def sparse_voxel_grid(voxel_grid):
+    """Convert any voxel grid to sparse storage"""
+    if isinstance(voxel_grid, SparseVoxelGrid):
+        return voxel_grid
+    origin_index = np.round(voxel_grid.transform[:3, 3] / voxel_grid._pitch).astype(np.int64)
+    indices = np.flatnonzero(voxel_grid.matrix)
+    return SparseVoxelGrid(indices, voxel_grid.shape, voxel_grid._pitch, origin_index)
+
+def voxel_slice(voxel_grid, axis, index):
+    """Dense 2D occupancy of one grid plane, without densifying sparse or packed grids"""
+    if isinstance(voxel_grid, (SparseVoxelGrid, PackedVoxelGrid)):
+        return voxel_grid.slice(axis, index)
+    return np.take(voxel_grid.matrix, index, axis=axis)
+
+def _spread_bits(values):
+    """Insert two zero bits between each of the low 21 bits of values"""
+    v = values.astype(np.uint64) & np.uint64(0x1fffff)
+    for shift, mask in ((32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f),
+                        (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+def _compact_bits(codes):
+    """Inverse of _spread_bits: gather every third bit of codes"""
+    v = codes & np.uint64(0x1249249249249249)
+    for shift, mask in ((2, 0x10c30c30c30c30c3), (4, 0x100f00f00f00f00f), (8, 0x1f0000ff0000ff),
+                        (16, 0x1f00000000ffff), (32, 0x1fffff)):
+        v = (v | (v >> np.uint64(shift))) & np.uint64(mask)
+    return v.astype(np.int64)
+
+def morton_encode(points):
+    """Morton (Z-order) codes of (n, 3) non-negative integer points"""
+    return (_spread_bits(points[:, 0]) << np.uint64(2)) | (_spread_bits(points[:, 1]) << np.uint64(1)) \
+        | _spread_bits(points[:, 2])
+
+def morton_decode(codes):
+    """(n, 3) integer points of Morton codes"""
+    return np.column_stack([_compact_bits(codes >> np.uint64(shift)) for shift in (2, 1, 0)])
+
+class VoxelOctree:
+    """Sparse voxel octree over the Morton codes of a grid's filled voxels
+    
+    Level k holds the sorted codes of the occupied 2^k-voxel cubes and the
+    number of filled voxels in each, so occupancy and counts at any level are
+    binary searches. Level 0 is the full-detail grid.
+    """
+    
+    def __init__(self, points, shape):
+        self.shape = tuple(int(n) for n in shape)
+        self.depth = max(1, int(np.ceil(np.log2(max(self.shape)))))
+        codes = np.sort(morton_encode(points))
+        counts = np.ones(len(codes), dtype=np.int64)
+        self.levels = [(codes, counts)]
+        for _ in range(self.depth):
+            # Parents are runs of equal shifted codes in the sorted child codes
+            codes = codes >> np.uint64(3)
+            boundary = np.ones(len(codes), dtype=bool)
+            boundary[1:] = codes[1:] != codes[:-1]
+            starts = np.flatnonzero(boundary)
+            if len(starts):
+                codes, counts = codes[starts], np.add.reduceat(counts, starts)
+            self.levels.append((codes, counts))
+    
+    @property
+    def nbytes(self):
+        return sum(codes.nbytes + counts.nbytes for codes, counts in self.levels)
+    
+    def _lookup(self, codes, level):
+        """Filled voxel counts of the level cells with the given codes (0 where empty)"""
+        level_codes, level_counts = self.levels[level]
+        if len(level_codes) == 0:
+            return np.zeros(len(codes), dtype=np.int64)
+        index = np.minimum(np.searchsorted(level_codes, codes), len(level_codes) - 1)
+        return np.where(level_codes[index] == codes, level_counts[index], 0)
+    
+    def counts(self, points, level=0):
+        """Filled voxel counts of the level cells containing (n, 3) voxel indices"""
+        return self._lookup(morton_encode(np.asarray(points) >> level), level)
+    
+    def occupied(self, points, level=0):
+        """Whether the level cells containing (n, 3) voxel indices hold any filled voxel"""
+        return self.counts(points, level) > 0
+    
+    def count(self, lo, hi):
+        """Number of filled voxels with indices in the box [lo, hi)
+        
+        Descends from the root, summing whole cells inside the box with one
+        lookup each and splitting only occupied cells that straddle its faces.
+        """
+        lo, hi = np.asarray(lo), np.asarray(hi)
+        cells = np.zeros(1, dtype=np.uint64)
+        total = 0
+        for level in range(self.depth, -1, -1):
+            counts = self._lookup(cells, level)
+            first = morton_decode(cells) << level
+            inside = ((first >= lo) & (first + (1 << level) <= hi)).all(axis=1)
+            overlap = ((first < hi) & (first + (1 << level) > lo)).all(axis=1)
+            total += int(counts[inside].sum())
+            
+            partial = cells[overlap & ~inside & (counts > 0)]
+            cells = ((partial[:, None] << np.uint64(3)) | np.arange(8, dtype=np.uint64)).reshape(-1)
+        return total
+    
+    def cells(self, level):
+        """Return (first voxel index of each occupied level cell, filled voxels in it)"""
+        codes, counts = self.levels[level]
+        return morton_decode(codes) << level, counts
+    
+    def view_level(self, max_cells):
+        """Finest level with at most max_cells occupied cells"""
+        for level, (codes, _) in enumerate(self.levels):
+            if len(codes) <= max_cells:
+                return level
+        return self.depth
+    
+    def slice(self, axis, index, level=0):
+        """Max-pooled 2D occupancy of the level cells crossing one grid plane"""
+        first, _ = self.cells(level)
+        plane = first[first[:, axis] == (index >> level) << level]
+        plane = np.delete(plane, axis, axis=1) >> level
+        plane_shape = [-(-n >> level) for i, n in enumerate(self.shape) if i != axis]
+        data = np.zeros(plane_shape, dtype=bool)
+        data[plane[:, 0], plane[:, 1]] = True
+        return data
+
+def get_voxel_octree(voxel_grid):
+    """Octree of a voxel grid, built once and kept on the grid"""
+    if getattr(voxel_grid, '_octree', None) is None:
+        voxel_grid._octree = VoxelOctree(voxel_grid.sparse_indices, voxel_grid.shape)
+        # The octree is charged to the cached grid it hangs off
+        get_voxel_cache().refresh(voxel_grid)
+    return voxel_grid._octree
+
+# Offsets of the six face neighbors of a voxel
+FACE_NEIGHBORS = np.array([[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]])
+
+def empty_face_neighbors(points, shape, occupied=None):
+    """(N, 6) mask of which FACE_NEIGHBORS of each point are empty (outside the grid counts as empty)
+    
+    occupied holds the sorted linear indices of all occupied cells; by default the points themselves.
+    """
+    shape = np.asarray(shape, dtype=np.int64)
+    if occupied is None:
+        occupied = np.sort(np.ravel_multi_index(points.T, shape))
+    empty = np.ones((len(points), len(FACE_NEIGHBORS)), dtype=bool)
+    if len(occupied) == 0:
+        return empty
+    
+    # Look each shifted point up in the sorted occupied indices
+    for j, offset in enumerate(FACE_NEIGHBORS):
+        neighbors = points + offset
+        inside = np.flatnonzero(np.all((neighbors >= 0) & (neighbors < shape), axis=1))
+        keys = np.ravel_multi_index(neighbors[inside].T, shape)
+        found = np.minimum(np.searchsorted(occupied, keys), len(occupied) - 1)
+        empty[inside, j] = occupied[found] != keys
+    return empty
+
+def exposed_mask(points, shape):
+    """Mask of the occupied points with at least one empty face neighbor"""
+    return empty_face_neighbors(points, shape).any(axis=1)
+
+def get_exposed_voxels(voxel_grid, level=0):
+    """Filled voxels (or first voxels of occupied octree cells) with an empty face neighbor, kept on the grid"""
+    exposed = getattr(voxel_grid, '_exposed', None)
+    if exposed is None:
+        exposed = voxel_grid._exposed = {}
+    if level not in exposed:
+        if level:
+            first, _ = get_voxel_octree(voxel_grid).cells(level)
+            shape = -(-np.asarray(voxel_grid.shape) // (1 << level))
+            exposed[level] = first[exposed_mask(first >> level, shape)]
+        elif isinstance(voxel_grid, (SparseVoxelGrid, PackedVoxelGrid)):
+            points = voxel_grid.sparse_indices
+            exposed[level] = points[exposed_mask(points, voxel_grid.shape)]
+        else:
+            # Erosion with the 6-connected structure removes exactly the voxels with an empty face neighbor
+            matrix = voxel_grid.matrix
+            exposed[level] = np.argwhere(matrix & ~ndimage.binary_erosion(matrix))
+        get_voxel_cache().refresh(voxel_grid)
+    return exposed[level]
+
+def grid_placement(bounds, resolution):
+    """Return (pitch, origin_index, shape) of the grid covering bounds at a resolution"""
+    max_dimension = max(bounds[1] - bounds[0])
+    pitch = max_dimension / resolution
+    
+    # Same grid placement as trimesh: voxel centers sit on multiples of the pitch
+    origin_index = np.round(bounds[0] / pitch).astype(np.int64)
+    shape = np.round(bounds[1] / pitch).astype(np.int64) - origin_index + 1
+    return pitch, origin_index, shape
+
+def voxelize_chunks(chunks, bounds, resolution=50):
+    """Surface-voxelize triangle chunks into a grid spanning bounds, one chunk at a time"""
+    pitch, origin_index, shape = grid_placement(bounds, resolution)
+    matrix = np.zeros(shape, dtype=bool)
+    
+    for triangles in chunks:
+        cells, triangles = cluster_triangles(triangles, pitch)
+        
+        # Only triangles spanning several voxels need subdividing
+        faces = np.arange(len(triangles) * 3).reshape(-1, 3)
+        vertices, _ = trimesh.remesh.subdivide_to_size(
+            triangles.reshape(-1, 3).astype(np.float64), faces, max_edge=pitch / 2, max_iter=10)
+        
+        for hits in (cells, np.round(vertices / pitch).astype(np.int64)):
+            hits = np.clip(hits - origin_index, 0, shape - 1)
+            matrix[hits[:, 0], hits[:, 1], hits[:, 2]] = True
+    
+    return _voxel_grid_from_matrix(matrix, pitch, origin_index)
+
+# Native engine limits: triangles prepared at once, candidate (triangle, voxel) pairs
+# tested per batch (~100 bytes of temporaries each), and voxels a triangle's bounding
+# box may span before the triangle is split
+NATIVE_CHUNK_TRIANGLES = 65536
+NATIVE_MAX_PAIRS = 1 << 20
+NATIVE_MAX_TRIANGLE_CELLS = 512
+
+def _triangle_cell_ranges(tri):
+    """Return the first and last voxel index touched by each voxel-space triangle's bounding box"""
+    # Voxel i spans [i - 0.5, i + 0.5] in voxel space; a point on a shared boundary goes
+    # to the even voxel, the rounding grid_placement and trimesh use, so faces on the
+    # grid's outer boundary stay inside it
+    return np.rint(tri.min(axis=1)).astype(np.int64), np.rint(tri.max(axis=1)).astype(np.int64)
+
+def _split_large_triangles(tri, max_cells):
+    """Split voxel-space triangles at their edge midpoints until each box spans at most max_cells voxels"""
+    done = []
+    while len(tri):
+        first, last = _triangle_cell_ranges(tri)
+        large = (last - first + 1).prod(axis=1) > max_cells
+        done.append(tri[~large])
+        a, b, c = tri[large, 0], tri[large, 1], tri[large, 2]
+        ab, bc, ca = (a + b) / 2, (b + c) / 2, (c + a) / 2
+        tri = np.concatenate([
+            np.stack([a, ab, ca], axis=1), np.stack([ab, b, bc], axis=1),
+            np.stack([ca, bc, c], axis=1), np.stack([ab, bc, ca], axis=1),
+        ])
+    return np.concatenate(done)
+
+def _iter_box_cells(first, extents, max_pairs):
+    """Yield (owner, cells) batches listing every integer point of each box, at most max_pairs at a time
+    
+    Boxes are given by their first point and (n, d) extents; owner holds the
+    box index of each point.
+    """
+    counts = extents.prod(axis=1)
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        done = ends[start - 1] if start else 0
+        stop = max(int(np.searchsorted(ends, done + max_pairs, side='right')), start + 1)
+        
+        batch_counts = counts[start:stop]
+        owner = np.repeat(np.arange(start, stop), batch_counts)
+        offset = np.arange(len(owner)) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+        size = extents[owner]
+        cells = np.empty((len(owner), extents.shape[1]), dtype=np.int64)
+        for axis in range(extents.shape[1] - 1, 0, -1):
+            cells[:, axis] = offset % size[:, axis]
+            offset //= size[:, axis]
+        cells[:, 0] = offset
+        cells += first[owner]
+        
+        yield owner, cells
+        start = stop
+
+def iter_native_hits(triangles, pitch, origin_index, lo, hi, max_pairs=NATIVE_MAX_PAIRS, candidates=None):
+    """Yield (m, 3) grid indices of the voxels in [lo, hi) that triangles overlap
+    
+    Every voxel in a triangle's bounding box is a candidate, and candidates are
+    checked with the separating axis test against the triangle's plane and the
+    nine edge/box-axis cross products, at most max_pairs at a time. An optional
+    boolean candidates grid rules out voxels before the test.
+    """
+    tri = _split_large_triangles(triangles / pitch - origin_index, NATIVE_MAX_TRIANGLE_CELLS)
+    first, last = _triangle_cell_ranges(tri)
+    
+    # A triangle whose bounding box lies in one voxel overlaps exactly that voxel
+    single = (first == last).all(axis=1)
+    cells = first[single]
+    cells = cells[((cells >= lo) & (cells < hi)).all(axis=1)]
+    if candidates is not None:
+        cells = cells[candidates[cells[:, 0], cells[:, 1], cells[:, 2]]]
+    if len(cells):
+        yield cells
+    tri, first, last = tri[~single], first[~single], last[~single]
+    
+    first = np.maximum(first, lo)
+    last = np.minimum(last, np.asarray(hi) - 1)
+    extents = last - first + 1
+    inside = (extents > 0).all(axis=1)
+    tri, first, extents = tri[inside], first[inside], extents[inside]
+    if len(tri) == 0:
+        return
+    
+    # Project each triangle onto its candidate separating axes once
+    edges = np.roll(tri, -1, axis=1) - tri
+    edge_axes = np.cross(np.eye(3)[None, :, None, :], edges[:, None, :, :]).reshape(-1, 9, 3)
+    axes = np.concatenate([np.cross(edges[:, 0], edges[:, 1])[:, None], edge_axes], axis=1)
+    projections = np.einsum('nkj,nvj->nkv', axes, tri)
+    radius = 0.5 * np.abs(axes).sum(axis=2)
+    slack = 1e-9 * (np.abs(projections).max(axis=2) + radius)
+    low = projections.min(axis=2) - radius - slack
+    high = projections.max(axis=2) + radius + slack
+    
+    for owner, cells in _iter_box_cells(first, extents, max_pairs):
+        if candidates is not None:
+            keep = candidates[cells[:, 0], cells[:, 1], cells[:, 2]]
+            owner, cells = owner[keep], cells[keep]
+        
+        # A voxel overlaps its triangle unless one of the axes separates them
+        centers = cells.astype(np.float64)
+        overlap = np.ones(len(owner), dtype=bool)
+        for k in range(axes.shape[1]):
+            distance = (axes[owner, k] * centers).sum(axis=1)
+            overlap &= (low[owner, k] <= distance) & (distance <= high[owner, k])
+        
+        yield cells[overlap]
+
+# Duplicate hits gathered by sparse voxelization before they are merged
+SPARSE_COMPACT_VOXELS = 1 << 24
+
+def refinement_candidates(previous, bounds, resolution):
+    """Voxels of a finer grid that can overlap the surface, given a coarser grid of the same mesh
+    
+    A fine voxel can only touch the surface if its box overlaps a coarse surface
+    voxel, so empty coarse regions stay empty. With a finer pitch each fine
+    voxel overlaps at most two coarse voxels along each axis, which makes the
+    lookup a gather from the coarse grid dilated by one voxel upward. Returns
+    None unless the previous grid is coarser.
+    """
+    pitch, origin_index, shape = grid_placement(bounds, resolution)
+    coarse_pitch = previous._pitch
+    if coarse_pitch <= pitch:
         return None
+    coarse_origin = np.round(previous.transform[:3, 3] / coarse_pitch).astype(np.int64)
     
-    x, y, z = filled_positions[:, 0], filled_positions[:, 1], filled_positions[:, 2]
+    # Pad so the clipped lookups below stay in range
+    dilated = np.pad(previous.matrix, 1)
+    for axis in range(3):
+        lower, upper = [slice(None)] * 3, [slice(None)] * 3
+        lower[axis], upper[axis] = slice(None, -1), slice(1, None)
+        dilated[tuple(lower)] |= dilated[tuple(upper)]
     
-    # Calculate color values based on selection
+    # First coarse voxel overlapping each fine voxel, per axis
+    lookups = []
+    for axis in range(3):
+        fine = np.arange(shape[axis]) + origin_index[axis]
+        first = np.floor((fine - 0.5) * pitch / coarse_pitch + 0.5 - 1e-9).astype(np.int64)
+        lookups.append(np.clip(first - coarse_origin[axis] + 1, 0, dilated.shape[axis] - 2))
+    
+    return dilated[np.ix_(*lookups)]
+
+def voxelize_native(chunks, bounds, resolution=50, max_pairs=NATIVE_MAX_PAIRS, storage='dense', candidates=None):
+    """Surface-voxelize triangle chunks with batched triangle/box overlap tests into a preallocated grid"""
+    pitch, origin_index, shape = grid_placement(bounds, resolution)
+    
+    if storage == 'sparse':
+        # Gather linear indices of hits, merging duplicates whenever the backlog
+        # outgrows the merged set, so memory tracks the surface rather than the grid
+        found, pending, merged = [], 0, 0
+        for triangles in chunks:
+            for hits in iter_native_hits(triangles, pitch, origin_index, 0, shape, max_pairs, candidates):
+                found.append(np.ravel_multi_index(hits.T, shape))
+                pending += len(hits)
+                if pending - merged > max(merged, SPARSE_COMPACT_VOXELS):
+                    found = [np.unique(np.concatenate(found))]
+                    pending = merged = len(found[0])
+        indices = np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+        return SparseVoxelGrid(indices, shape, pitch, origin_index)
+    
+    if storage == 'packed':
+        # Set hit bits directly in the packed bytes, so the boolean grid never exists
+        packed = np.zeros((shape[0], shape[1], -(-shape[2] // 8)), dtype=np.uint8)
+        for triangles in chunks:
+            for hits in iter_native_hits(triangles, pitch, origin_index, 0, shape, max_pairs, candidates):
+                bits = (np.uint8(0x80) >> (hits[:, 2] & 7)).astype(np.uint8)
+                np.bitwise_or.at(packed, (hits[:, 0], hits[:, 1], hits[:, 2] >> 3), bits)
+        return PackedVoxelGrid(packed, shape, pitch, origin_index)
+    
+    matrix = np.zeros(shape, dtype=bool)
+    for triangles in chunks:
+        for hits in iter_native_hits(triangles, pitch, origin_index, 0, shape, max_pairs, candidates):
+            matrix[hits[:, 0], hits[:, 1], hits[:, 2]] = True
+    
+    return _voxel_grid_from_matrix(matrix, pitch, origin_index)
+
+# Edge length in voxels of the bricks handed to tiled voxelization workers, and bricks
+# queued per worker; the rest wait, so their triangle copies are made only when submitted
+TILED_BRICK_SIZE = 64
+TILED_IN_FLIGHT_PER_WORKER = 2
+
+def _voxelize_brick(shm_name, shape, triangles, pitch, origin_index, lo, hi):
+    """Tiled worker: write one brick's surface voxels straight into the shared grid"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        matrix = np.ndarray(shape, dtype=bool, buffer=shm.buf)
+        filled = 0
+        # Chunked like the single-process engine, so a crowded brick stays within its temporary memory
+        for start in range(0, len(triangles), NATIVE_CHUNK_TRIANGLES):
+            chunk = triangles[start:start + NATIVE_CHUNK_TRIANGLES]
+            for hits in iter_native_hits(chunk, pitch, origin_index, lo, hi):
+                matrix[hits[:, 0], hits[:, 1], hits[:, 2]] = True
+                filled += len(hits)
+        del matrix
+        return filled
+    finally:
+        shm.close()
+
+def voxelize_tiled(mesh_obj, bounds, resolution=50, workers=None, brick_size=TILED_BRICK_SIZE):
+    """Surface-voxelize with the native engine, one grid brick per task in a process pool
+    
+    Each brick receives only the triangles whose bounding boxes overlap it, and
+    workers write into a shared-memory grid so no voxels are pickled back.
+    """
+    workers = workers or os.cpu_count() or 1
+    pitch, origin_index, shape = grid_placement(bounds, resolution)
+    triangles = mesh_obj.triangles
+    
+    # List the bricks each triangle's bounding box touches, then group triangles by brick
+    first, last = _triangle_cell_ranges(triangles / pitch - origin_index)
+    first_brick = np.clip(first, 0, shape - 1) // brick_size
+    last_brick = np.clip(last, 0, shape - 1) // brick_size
+    bricks = -(-shape // brick_size)
+    owners, brick_ids = [], []
+    for owner, cells in _iter_box_cells(first_brick, last_brick - first_brick + 1, NATIVE_MAX_PAIRS):
+        owners.append(owner)
+        brick_ids.append(np.ravel_multi_index(cells.T, bricks))
+    owners, brick_ids = np.concatenate(owners), np.concatenate(brick_ids)
+    order = np.argsort(brick_ids, kind='stable')
+    owners, brick_ids = owners[order], brick_ids[order]
+    used, starts, counts = np.unique(brick_ids, return_index=True, return_counts=True)
+    
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)), 1))
+    try:
+        matrix = np.ndarray(shape, dtype=bool, buffer=shm.buf)
+        matrix[:] = False
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Submit the busiest bricks first so the pool drains evenly
+            pending = list(np.argsort(-counts, kind='stable'))[::-1]
+            futures = set()
+            while pending or futures:
+                while pending and len(futures) < workers * TILED_IN_FLIGHT_PER_WORKER:
+                    i = pending.pop()
+                    lo = np.array(np.unravel_index(used[i], bricks)) * brick_size
+                    hi = np.minimum(lo + brick_size, shape)
+                    brick_triangles = triangles[owners[starts[i]:starts[i] + counts[i]]]
+                    futures.add(pool.submit(_voxelize_brick, shm.name, tuple(shape), brick_triangles,
+                                            pitch, origin_index, lo, hi))
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        result = matrix.copy()
+        del matrix
+    finally:
+        shm.close()
+        shm.unlink()
+    
+    return _voxel_grid_from_matrix(result, pitch, origin_index)
+
+def parity_fill(chunks, pitch, origin_index, shape, max_pairs=NATIVE_MAX_PAIRS):
+    """Return the voxels whose centers lie inside a closed surface, by ray parity along Z
+    
+    One ray runs up each (x, y) column of voxel centers. Each triangle crossing
+    a ray toggles the voxel just above the crossing, and a cumulative XOR along
+    Z turns the toggles into inside/outside parity.
+    """
+    shape = np.asarray(shape)
+    toggles = np.zeros(shape, dtype=np.uint8)
+    
+    for triangles in chunks:
+        tri = triangles / pitch - origin_index
+        
+        # Orient every triangle counter-clockwise in XY; vertical ones cross no ray
+        a, b, c = tri[:, 0], tri[:, 1], tri[:, 2]
+        area = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+        flip = area < 0
+        b, c = np.where(flip[:, None], c, b), np.where(flip[:, None], b, c)
+        area = np.abs(area)
+        
+        # Columns whose centers fall inside each triangle's XY bounding box
+        first = np.maximum(np.ceil(tri[:, :, :2].min(axis=1)).astype(np.int64), 0)
+        last = np.minimum(np.floor(tri[:, :, :2].max(axis=1)).astype(np.int64), shape[:2] - 1)
+        extents = last - first + 1
+        keep = (extents > 0).all(axis=1) & (area > 0)
+        a, b, c, area, first, extents = a[keep], b[keep], c[keep], area[keep], first[keep], extents[keep]
+        
+        # Edge opposite each vertex. Edges are evaluated from their lexicographically
+        # smaller end so both triangles sharing an edge round identically, and a ray
+        # exactly through an edge is claimed by one of them via a tie-break on direction
+        edges = []
+        for p, q in ((b, c), (c, a), (a, b)):
+            reverse = (p[:, 0] > q[:, 0]) | ((p[:, 0] == q[:, 0]) & (p[:, 1] > q[:, 1]))
+            claims_ties = (q[:, 1] > p[:, 1]) | ((q[:, 1] == p[:, 1]) & (q[:, 0] < p[:, 0]))
+            start = np.where(reverse[:, None], q, p)
+            direction = np.where(reverse[:, None], p - q, q - p)
+            edges.append((start, direction, np.where(reverse, -1.0, 1.0), claims_ties))
+        
+        for owner, columns in _iter_box_cells(first, extents, max_pairs):
+            x, y = columns[:, 0].astype(np.float64), columns[:, 1].astype(np.float64)
+            inside = np.ones(len(owner), dtype=bool)
+            height = np.zeros(len(owner))
+            for (start, direction, sign, claims_ties), corner in zip(edges, (a, b, c)):
+                start, direction = start[owner], direction[owner]
+                weight = direction[:, 0] * (y - start[:, 1]) - direction[:, 1] * (x - start[:, 0])
+                weight *= sign[owner]
+                inside &= (weight > 0) | ((weight == 0) & claims_ties[owner])
+                height += weight * corner[owner, 2]
+            height /= area[owner]
+            
+            # Toggle the first voxel center above the crossing; crossings above the grid toggle nothing
+            layer = np.maximum(np.floor(height).astype(np.int64) + 1, 0)
+            inside &= layer < shape[2]
+            columns, layer = columns[inside], layer[inside]
+            
+            # Two crossings at the same voxel cancel out
+            index, counts = np.unique((columns[:, 0] * shape[1] + columns[:, 1]) * shape[2] + layer,
+                                      return_counts=True)
+            toggles.reshape(-1)[index[counts % 2 == 1]] ^= 1
+    
+    return np.bitwise_xor.accumulate(toggles, axis=2).view(bool)
+
+def fill_voxel_grid(mesh_obj, voxel_grid):
+    """Add the interior to a surface voxel grid, by ray parity for watertight meshes"""
+    pitch = voxel_grid._pitch
+    origin_index = np.round(voxel_grid.transform[:3, 3] / pitch).astype(np.int64)
+    surface = voxel_grid.matrix
+    
+    if mesh_obj.is_watertight:
+        interior = parity_fill(iter_mesh_chunks(mesh_obj, NATIVE_CHUNK_TRIANGLES), pitch, origin_index, surface.shape)
+    else:
+        show_message('warning', "Mesh is not watertight, so only cavities fully enclosed by the voxel shell are filled")
+        interior = ndimage.binary_fill_holes(surface)
+    
+    return _voxel_grid_from_matrix(surface | interior, pitch, origin_index)
+
+def voxelize_stl_path(path, resolution=50, chunk_size=STL_CHUNK_TRIANGLES):
+    """Voxelize a binary STL on disk in two streaming passes without loading the mesh"""
+    bounds = stl_chunk_bounds(iter_stl_chunks(path, chunk_size))
+    return voxelize_chunks(iter_stl_chunks(path, chunk_size), bounds, resolution)
+
+# Filled voxels per pitch² of mesh area in a surface shell, and the shell's surplus
+# over the enclosed volume in solid grids, as measured on curved meshes
+SURFACE_VOXELS_PER_AREA = 1.5
+SOLID_SHELL_VOXELS_PER_AREA = 0.75
+
+# Resolution of the quick pass that calibrates the voxel count estimate to a mesh
+CALIBRATION_RESOLUTION = 32
+
+# Faces per pass when summarizing a mesh for estimates
+MESH_SUMMARY_FACES = 1 << 20
+
+def mesh_summary(mesh_obj):
+    """Area, signed volume, longest-edge sums and watertightness of a mesh from one pass over its faces
+    
+    Works on the vertex and face arrays in bounded chunks, so trimesh's cached
+    triangles and other derived arrays are never built. The summary is kept in
+    the mesh metadata, so estimates from it are the same on every rerun.
+    """
+    summary = mesh_obj.metadata.get('summary')
+    if summary is None:
+        vertices, faces = mesh_obj.vertices, mesh_obj.faces
+        summary = {'area': 0.0, 'signed_volume': 0.0, 'longest_edges': 0.0, 'longest_edges_squared': 0.0}
+        # One int64 key per undirected edge, as trimesh's edges_sorted but a third of the size
+        edge_keys = np.empty(3 * len(faces), dtype=np.int64)
+        for start in range(0, len(faces), MESH_SUMMARY_FACES):
+            chunk = faces[start:start + MESH_SUMMARY_FACES]
+            for k in range(3):
+                u, v = chunk[:, k], chunk[:, (k + 1) % 3]
+                edge_keys[3 * start + k * len(chunk):3 * start + (k + 1) * len(chunk)] = (
+                    np.minimum(u, v) * len(vertices) + np.maximum(u, v))
+            a, b, c = (vertices[chunk[:, k]] for k in range(3))
+            cross = np.cross(b - a, c - a)
+            summary['area'] += 0.5 * np.linalg.norm(cross, axis=1).sum()
+            summary['signed_volume'] += np.einsum('ij,ij->', a, cross) / 6
+            longest = np.maximum.reduce([((b - a)**2).sum(axis=1), ((c - b)**2).sum(axis=1),
+                                         ((a - c)**2).sum(axis=1)])
+            summary['longest_edges'] += np.sqrt(longest).sum()
+            summary['longest_edges_squared'] += longest.sum()
+        # Watertight as trimesh defines it: every edge shared by exactly two faces
+        edge_keys.sort()
+        pairs, following = edge_keys[0::2], edge_keys[1::2]
+        summary['is_watertight'] = bool(len(faces) and len(pairs) == len(following) and
+                                        (pairs == following).all() and (following[:-1] != pairs[1:]).all())
+        mesh_obj.metadata['summary'] = summary
+    return summary
+
+def estimate_voxel_count(mesh_obj, pitch, mode='surface'):
+    """Predicted filled voxels at a pitch, from the mesh area and, for solid grids, its volume"""
+    summary = mesh_summary(mesh_obj)
+    shell = summary['area'] / pitch**2
+    if mode == 'solid':
+        # Without a closed surface there is no volume; the bounding box bounds it
+        volume = abs(summary['signed_volume']) if summary['is_watertight'] else np.prod(mesh_obj.extents)
+        return volume / pitch**3 + SOLID_SHELL_VOXELS_PER_AREA * shell
+    return SURFACE_VOXELS_PER_AREA * shell
+
+def estimate_voxel_bytes(mesh_obj, pitch, filled, storage='dense'):
+    """Predicted memory of a finished grid at a pitch holding `filled` voxels"""
+    if storage == 'sparse':
+        return 8 * filled
+    bounds = mesh_obj.bounds
+    shape = np.round(bounds[1] / pitch) - np.round(bounds[0] / pitch) + 1
+    if storage == 'packed':
+        return shape[0] * shape[1] * np.ceil(shape[2] / 8)
+    return np.prod(shape)
+
+def budget_resolution(mesh_obj, max_voxels=None, max_mb=None, mode='surface', storage='dense', calibrate=False,
+                      **options):
+    """Highest resolution whose predicted filled voxels and grid memory stay within budget
+    
+    Estimates come from the mesh area and volume; with calibrate, a quick
+    low-resolution pass scales them to this mesh and the voxelization options.
+    """
+    longest = max(mesh_obj.extents)
+    scale = 1.0
+    if calibrate:
+        voxel_grid = voxelize_mesh_cached(mesh_obj, CALIBRATION_RESOLUTION, mode=mode, **options)
+        if voxel_grid is not None:
+            scale = voxel_grid.filled_count / max(estimate_voxel_count(mesh_obj, voxel_grid._pitch, mode), 1)
+    
+    def fits(resolution):
+        pitch = longest / resolution
+        filled = scale * estimate_voxel_count(mesh_obj, pitch, mode)
+        if max_voxels is not None and filled > max_voxels:
+            return False
+        return max_mb is None or estimate_voxel_bytes(mesh_obj, pitch, filled, storage) <= max_mb * 2**20
+    
+    # Both estimates grow with resolution, so bisect for the last one that fits
+    lo, hi = 1, 1 << 20
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+# Predicted cost above which the app warns, and above which it refuses to voxelize
+COST_WARN_SECONDS = float(os.environ.get('VOXELIZE_WARN_SECONDS', 30))
+COST_MAX_SECONDS = float(os.environ.get('VOXELIZE_MAX_SECONDS', 600))
+COST_WARN_MB = float(os.environ.get('VOXELIZE_WARN_MB', 1024))
+COST_MAX_MB = float(os.environ.get('VOXELIZE_MAX_MB', 8192))
+
+# (shape, detail, resolution) of the runs that calibrate the cost model; the tilted
+# cylinders contribute long thin triangles, which cost far more per triangle
+COST_CALIBRATION_RUNS = [
+    ('sphere', 2, 32), ('sphere', 4, 32), ('sphere', 3, 64), ('sphere', 2, 96), ('sphere', 4, 96),
+    ('cylinder', 16, 32), ('cylinder', 64, 32), ('cylinder', 16, 64),
+]
+
+def cost_features(mesh_obj, resolution, mode='surface', storage='dense'):
+    """Cost model inputs: a constant, triangles, longest edges in voxels, predicted surface voxels and densely held grid cells"""
+    pitch = max(mesh_obj.extents) / resolution
+    bounds = mesh_obj.bounds
+    cells = np.prod(np.round(bounds[1] / pitch) - np.round(bounds[0] / pitch) + 1)
+    # Solid fills always run on a dense grid; surface grids are only as dense as their storage
+    if mode == 'surface' and storage == 'sparse':
+        cells = 0.0
+    elif mode == 'surface' and storage == 'packed':
+        cells /= 8
+    # Long triangles cost more: the native engine splits them (linear in the longest edge)
+    # and trimesh subdivides them (quadratic in the longest edge)
+    summary = mesh_summary(mesh_obj)
+    return np.array([
+        1.0, len(mesh_obj.faces), summary['longest_edges'] / pitch, summary['longest_edges_squared'] / pitch**2,
+        estimate_voxel_count(mesh_obj, pitch, 'surface'), cells,
+    ])
+
+def cost_calibration_mesh(shape, detail):
+    """Small synthetic mesh for one calibration run"""
+    if shape == 'sphere':
+        return trimesh.creation.icosphere(subdivisions=detail)
+    mesh_obj = trimesh.creation.cylinder(radius=0.3, height=5, sections=detail)
+    mesh_obj.apply_transform(trimesh.transformations.rotation_matrix(0.7, [1, 1, 0]))
+    return mesh_obj
+
+def calibrate_cost_model(engine='trimesh', mode='surface'):
+    """Fit time and peak memory coefficients of the cost features by voxelizing small meshes here"""
+    rows, seconds, peaks = [], [], []
+    for shape, detail, resolution in COST_CALIBRATION_RUNS:
+        mesh_obj = cost_calibration_mesh(shape, detail)
+        rows.append(cost_features(mesh_obj, resolution, mode))
+        
+        start = time.perf_counter()
+        voxelize_mesh(mesh_obj, resolution, engine=engine, mode=mode)
+        seconds.append(time.perf_counter() - start)
+        
+        tracemalloc.start()
+        voxelize_mesh(mesh_obj, resolution, engine=engine, mode=mode)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    
+    # Non-negative least squares on scaled columns, so every term adds cost
+    rows = np.array(rows)
+    scale = rows.max(axis=0)
+    return {
+        'seconds': optimize.nnls(rows / scale, np.array(seconds))[0] / scale,
+        'bytes': optimize.nnls(rows / scale, np.array(peaks, dtype=np.float64))[0] / scale,
+    }
+
+@st.cache_resource(show_spinner="Calibrating the cost model on this machine...")
+def get_cost_model(engine='trimesh', mode='surface'):
+    """Cost model of one engine and mode, calibrated once per server process
+    
+    Calibration runs in a separate process: tracemalloc traces a whole process, so
+    in the server it would also count other sessions' and threads' allocations.
+    """
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(calibrate_cost_model, engine, mode).result()
+
+def estimate_voxelization_cost(mesh_obj, resolution=50, mode='surface', engine='trimesh', storage='dense'):
+    """Predict the runtime, peak memory and filled voxels of voxelize_mesh before running it
+    
+    Returns a dict with 'seconds', 'peak_mb' and 'voxels'.
+    """
+    model = get_cost_model(engine, mode)
+    features = cost_features(mesh_obj, resolution, mode, storage)
+    return {
+        'seconds': float(features @ model['seconds']),
+        'peak_mb': float(features @ model['bytes']) / 2**20,
+        'voxels': float(estimate_voxel_count(mesh_obj, max(mesh_obj.extents) / resolution, mode)),
+    }
+
+# Upper bound on memory held by voxel grids, plus an optional on-disk tier
+VOXEL_CACHE_MAX_MB = float(os.environ.get('VOXELIZE_VOXEL_CACHE_MB', 1024))
+VOXEL_CACHE_DIR = os.environ.get('VOXELIZE_VOXEL_CACHE_DIR')
+VOXEL_CACHE_DISK_MB = float(os.environ.get('VOXELIZE_VOXEL_CACHE_DISK_MB', 10240))
+
+# Views derived from a grid and kept on it: the octree, then dicts of arrays or array tuples
+DERIVED_VOXEL_DATA = ['_exposed', '_cube_meshes', '_isosurfaces']
+
+def derived_nbytes(voxel_grid):
+    """Memory held by the octree, surface cells and render meshes kept on a grid"""
+    octree = getattr(voxel_grid, '_octree', None)
+    total = octree.nbytes if octree is not None else 0
+    for name in DERIVED_VOXEL_DATA:
+        for value in getattr(voxel_grid, name, {}).values():
+            arrays = value if isinstance(value, tuple) else (value,)
+            total += sum(array.nbytes for array in arrays if isinstance(array, np.ndarray))
+    return total
+
+def voxel_nbytes(voxel_grid):
+    """Approximate memory held by a voxel grid once its matrix is materialized, plus its derived views"""
+    if isinstance(voxel_grid, SparseVoxelGrid):
+        size = voxel_grid.indices.nbytes
+    elif isinstance(voxel_grid, PackedVoxelGrid):
+        size = voxel_grid.packed.nbytes
+    else:
+        size = int(np.prod(voxel_grid.shape))
+    return size + derived_nbytes(voxel_grid)
+
+@st.cache_resource
+def get_voxel_cache():
+    """Process-wide voxel grid cache shared by all reruns and sessions"""
+    return LRUCache(int(VOXEL_CACHE_MAX_MB * 2**20), voxel_nbytes)
+
+def mesh_content_hash(mesh_obj):
+    """Content hash of a mesh, preferring the upload hash recorded by the loader"""
+    if 'content_hash' not in mesh_obj.metadata:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.ascontiguousarray(mesh_obj.vertices).tobytes())
+        digest.update(np.ascontiguousarray(mesh_obj.faces).tobytes())
+        mesh_obj.metadata['content_hash'] = digest.hexdigest()
+    return mesh_obj.metadata['content_hash']
+
+def voxel_cache_key(mesh_obj, resolution, **options):
+    """Cache key covering the mesh content, resolution and every voxelization option"""
+    # The worker count and a previous grid change how a grid is computed, not the grid itself
+    options.pop('workers', None)
+    options.pop('previous', None)
+    parts = (mesh_content_hash(mesh_obj), resolution, sorted(options.items()))
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+def write_voxel_npz(f, voxel_grid):
+    """Write a voxel grid's filled voxels, shape and placement to an .npz file object"""
+    if isinstance(voxel_grid, SparseVoxelGrid):
+        np.savez(f, linear_indices=voxel_grid.indices, shape=np.asarray(voxel_grid.shape),
+                 transform=voxel_grid.transform, pitch=voxel_grid._pitch)
+    elif isinstance(voxel_grid, PackedVoxelGrid):
+        np.savez(f, packed=voxel_grid.packed, shape=np.asarray(voxel_grid.shape),
+                 transform=voxel_grid.transform, pitch=voxel_grid._pitch)
+    else:
+        np.savez(f, indices=voxel_grid.sparse_indices, shape=np.asarray(voxel_grid.shape),
+                 transform=voxel_grid.transform, pitch=voxel_grid._pitch)
+
+def save_voxel_grid(path, voxel_grid):
+    """Write a voxel grid to an .npz file, replacing any existing file atomically"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write_voxel_npz(f, voxel_grid)
+    os.replace(tmp_path, path)
+
+def load_voxel_grid(path):
+    """Read a voxel grid written by save_voxel_grid"""
+    with np.load(path) as data:
+        if 'linear_indices' in data or 'packed' in data:
+            pitch = float(data['pitch'])
+            origin_index = np.round(data['transform'][:3, 3] / pitch).astype(np.int64)
+            if 'packed' in data:
+                return PackedVoxelGrid(data['packed'], data['shape'], pitch, origin_index)
+            return SparseVoxelGrid(data['linear_indices'], data['shape'], pitch, origin_index)
+        encoding = trimesh.voxel.encoding.SparseBinaryEncoding(data['indices'], shape=tuple(data['shape']))
+        voxel_grid = trimesh.voxel.VoxelGrid(encoding, transform=data['transform'])
+        voxel_grid._pitch = float(data['pitch'])
+    return voxel_grid
+
+def _trim_disk_cache(directory, max_bytes):
+    """Delete the least recently used cache files until the directory fits in max_bytes"""
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.npz'):
+            stat = os.stat(os.path.join(directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def voxelize_mesh_cached(mesh_obj, resolution=50, **options):
+    """Voxelize through the in-memory cache, then the optional disk cache"""
+    cache = get_voxel_cache()
+    key = voxel_cache_key(mesh_obj, resolution, **options)
+    voxel_grid = cache.get(key)
+    if voxel_grid is not None:
+        return voxel_grid
+    
+    disk_path = os.path.join(VOXEL_CACHE_DIR, f"{key}.npz") if VOXEL_CACHE_DIR else None
+    if disk_path and os.path.exists(disk_path):
+        try:
+            voxel_grid = load_voxel_grid(disk_path)
+            voxel_grid._engine = options.get('engine', 'trimesh')
+            voxel_grid._mode = options.get('mode', 'surface')
+            # Touch the file so the disk tier evicts by last use
+            os.utime(disk_path)
+        except Exception as e:
+            show_message('warning', f"Ignoring unreadable voxel cache file: {str(e)}")
+    
+    if voxel_grid is None:
+        voxel_grid = voxelize_mesh(mesh_obj, resolution, **options)
+        # Voxelizing fills trimesh's caches (triangles, normals), which the mesh cache must count
+        get_mesh_cache().refresh(mesh_obj)
+        if voxel_grid is None:
+            return None
+        if disk_path:
+            try:
+                os.makedirs(VOXEL_CACHE_DIR, exist_ok=True)
+                save_voxel_grid(disk_path, voxel_grid)
+                _trim_disk_cache(VOXEL_CACHE_DIR, VOXEL_CACHE_DISK_MB * 2**20)
+            except OSError as e:
+                show_message('warning', f"Could not write voxel cache file: {str(e)}")
+    
+    cache.put(key, voxel_grid)
+    return voxel_grid
+
+# Coarse-to-fine passes of progressive voxelization, each at half the next resolution
+PROGRESSIVE_PASSES = 4
+
+def progressive_resolutions(resolution, passes=PROGRESSIVE_PASSES, min_resolution=10):
+    """Pass resolutions halving down from the requested one, coarsest first"""
+    steps = {resolution // 2**k for k in range(passes)}
+    return sorted(r for r in steps if r >= min_resolution or r == resolution)
+
+def voxelize_progressive(mesh_obj, resolution=50, passes=PROGRESSIVE_PASSES, **options):
+    """Yield (resolution, voxel grid) for each coarse pass and finally the requested resolution
+    
+    Every pass goes through the voxel cache, so revisiting a resolution is free.
+    """
+    for pass_resolution in progressive_resolutions(resolution, passes):
+        voxel_grid = voxelize_mesh_cached(mesh_obj, pass_resolution, **options)
+        if voxel_grid is None:
+            return
+        yield pass_resolution, voxel_grid
+
+def _voxelize_batch_item(item, resolution, weld_tolerance, options, return_grid=False):
+    """Batch worker: load and voxelize one mesh file given as a path or a (name, bytes) pair"""
+    start = time.perf_counter()
+    if isinstance(item, (str, os.PathLike)):
+        name = os.path.basename(item)
+        with open(item, 'rb') as f:
+            data = f.read()
+    else:
+        name, data = item
+    
+    upload = io.BytesIO(data)
+    upload.name = name
+    mesh_obj = load_mesh_file(upload, weld_tolerance)
+    if mesh_obj is None or len(mesh_obj.faces) == 0:
+        raise ValueError("could not load a mesh from the file")
+    voxel_grid = voxelize_mesh(mesh_obj, resolution, **options)
+    if voxel_grid is None:
+        raise ValueError("voxelization failed")
+    
+    result = {
+        'name': name,
+        'triangles': len(mesh_obj.faces),
+        'filled_voxels': int(voxel_grid.filled_count),
+        'grid_shape': tuple(int(n) for n in voxel_grid.shape),
+        'pitch': voxel_grid._pitch,
+        'seconds': time.perf_counter() - start,
+    }
+    # Grids are pickled back to the parent, so only send them when asked
+    if return_grid:
+        result['voxel_grid'] = voxel_grid
+    return result
+
+# Batch files submitted to the pool per worker at a time; the rest wait unread
+BATCH_IN_FLIGHT_PER_WORKER = 2
+
+def voxelize_batch(items, resolution=50, weld_tolerance=WELD_TOLERANCE, max_workers=None, return_grids=False,
+                   **options):
+    """Load and voxelize many files in a process pool, yielding results as they finish
+    
+    Items are file paths or (name, data) pairs, where data is bytes or a buffer such
+    as an upload's getbuffer() view; items may be a lazy iterable, since only a few
+    per worker are in flight, and only those are copied to the workers. Options are
+    passed on to voxelize_mesh. Results carry the voxel grid only with return_grids,
+    and failed files yield a result with an 'error' message instead.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        
+        def submit_next():
+            item = next(items, None)
+            if item is None:
+                return False
+            if isinstance(item, (str, os.PathLike)):
+                name = os.path.basename(item)
+            else:
+                # Buffers cannot be pickled, so copy the file for its worker only now
+                name, data = item
+                item = (name, bytes(data))
+            futures[pool.submit(_voxelize_batch_item, item, resolution, weld_tolerance, options, return_grids)] = name
+            return True
+        
+        while len(futures) < max_workers * BATCH_IN_FLIGHT_PER_WORKER and submit_next():
+            pass
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield {'name': name, 'error': str(e)}
+                submit_next()
+
+# Most occupied octree cells shown in the 3D view before it defaults to a coarser level
+OCTREE_VIEW_CELLS = 200000
+# Default for the most markers (or cube cells) the 3D view sends to the browser
+MAX_VIEW_POINTS = 200000
+
+def points_level(voxel_grid, max_points, level=0, surface_only=True):
+    """Finest octree level, no finer than level, whose 3D view needs at most max_points markers
+    
+    The octree levels are the grid's 2x2x2 max-pool pyramid, and they and their exposed
+    cells are kept on the grid, so changing the budget only repeats these lookups.
+    """
+    octree = get_voxel_octree(voxel_grid)
+    for candidate in range(level, octree.depth + 1):
+        # Exposed cells are a subset of the occupied ones, which are cheaper to count
+        if len(octree.levels[candidate][0]) <= max_points:
+            return candidate
+        if surface_only and len(get_exposed_voxels(voxel_grid, candidate)) <= max_points:
+            return candidate
+    return octree.depth
+
+def voxel_color_values(positions, color_by="Z-coordinate"):
+    """Return (color value per position, colorbar title) for a color mapping option"""
+    x, y, z = positions[:, 0], positions[:, 1], positions[:, 2]
     if color_by == "Z-coordinate":
-        color_values = z
-        color_title = "Z"
+        return z, "Z"
     elif color_by == "Y-coordinate":
-        color_values = y
-        color_title = "Y"
+        return y, "Y"
     elif color_by == "X-coordinate":
-        color_values = x
-        color_title = "X"
+        return x, "X"
     elif color_by == "Distance from Center":
         center_x, center_y, center_z = np.mean(x), np.mean(y), np.mean(z)
-        color_values = np.sqrt((x - center_x)**2 + (y - center_y)**2 + (z - center_z)**2)
-        color_title = "Distance"
+        return np.sqrt((x - center_x)**2 + (y - center_y)**2 + (z - center_z)**2), "Distance"
     elif color_by == "Radial (XY)":
         center_x, center_y = np.mean(x), np.mean(y)
-        color_values = np.sqrt((x - center_x)**2 + (y - center_y)**2)
-        color_title = "Radial XY"
+        return np.sqrt((x - center_x)**2 + (y - center_y)**2), "Radial XY"
     else:  # Random
         np.random.seed(42)  # For consistent colors
-        color_values = np.random.rand(len(x))
-        color_title = "Random"
+        return np.random.rand(len(x)), "Random"
+
+# Most markers in the 3D view that still get hover labels
+HOVER_MAX_POINTS = 200000
+
+RENDER_MODES = ['Markers', 'Cubes', 'Isosurface']
+RENDER_MODE_HELP = ("Markers: one point per voxel. "
+                    "Cubes: solid voxel faces, with coplanar faces of similar color merged into rectangles. "
+                    "Isosurface: a smooth marching cubes surface, coarsened to stay under a triangle budget")
+
+# Distinct colors in cube rendering; faces merge only within one level
+CUBE_COLOR_LEVELS = 64
+
+def _merge_runs(keys, position):
+    """Sort by keys, then position; return (order, run starts and run lengths in sorted order)
     
-    fig = go.Figure(data=go.Scatter3d(
-        x=x, y=y, z=z,
-        mode='markers',
-        marker=dict(
-            size=marker_size,
-            color=color_values,
-            colorscale=colormap,
-            opacity=opacity,
-            showscale=True,
-            line=dict(width=0.5, color='rgba(0,0,0,0.1)')
-        ),
-        text=[f'Voxel ({i},{j},{k})' for i,j,k in zip(x,y,z)],
-        hovertemplate=f'<b>Voxel</b><br>X: %{{x}}<br>Y: %{{y}}<br>Z: %{{z}}<br>{color_title}: %{{marker.color:.2f}}<extra></extra>'
+    A run is a stretch of consecutive positions with equal keys.
+    """
+    order = np.lexsort((position,) + tuple(keys[::-1]))
+    position = position[order]
+    breaks = np.ones(len(order), dtype=bool)
+    breaks[1:] = position[1:] != position[:-1] + 1
+    for key in keys:
+        key = key[order]
+        breaks[1:] |= key[1:] != key[:-1]
+    starts = np.flatnonzero(breaks)
+    return order, starts, np.diff(np.append(starts, len(order)))
+
+def greedy_voxel_mesh(cells, shape, color_keys, occupied=None):
+    """Triangles covering the empty-neighbor faces of cells, with coplanar faces merged into rectangles
+    
+    Faces are merged into runs along one in-plane axis, then runs of equal extent along the
+    other, only where their color keys match. Returns (vertices at cell corners, triangles,
+    color key per triangle).
+    """
+    empty = empty_face_neighbors(cells, shape, occupied)
+    direction, plane, u, v, key = [], [], [], [], []
+    for j in range(len(FACE_NEIGHBORS)):
+        axis = j // 2
+        faces = cells[empty[:, j]]
+        direction.append(np.full(len(faces), j))
+        # Faces toward +axis lie on the far corner plane of the cell
+        plane.append(faces[:, axis] + (j % 2 == 0))
+        u.append(faces[:, (axis + 1) % 3])
+        v.append(faces[:, (axis + 2) % 3])
+        key.append(color_keys[empty[:, j]])
+    direction, plane, u, v, key = map(np.concatenate, (direction, plane, u, v, key))
+    
+    # Faces into runs along u, then runs into rectangles along v
+    order, starts, u_length = _merge_runs([direction, plane, key, v], u)
+    direction, plane, key, v, u = (a[order][starts] for a in (direction, plane, key, v, u))
+    order, starts, v_length = _merge_runs([direction, plane, key, u, u_length], v)
+    direction, plane, key, u, u_length, v = (a[order][starts] for a in (direction, plane, key, u, u_length, v))
+    
+    # Four corners per rectangle, counter-clockwise around the +axis normal
+    rows = np.arange(len(direction))
+    axis = direction // 2
+    corners = np.empty((len(rows), 4, 3), dtype=np.int64)
+    for c, (du, dv) in enumerate([(0, 0), (1, 0), (1, 1), (0, 1)]):
+        corners[rows, c, axis] = plane
+        corners[rows, c, (axis + 1) % 3] = u + du * u_length
+        corners[rows, c, (axis + 2) % 3] = v + dv * v_length
+    
+    # Two triangles per rectangle, wound to face away from the filled cell
+    first = np.where((direction % 2 == 0)[:, None, None], [[0, 1, 2], [0, 2, 3]], [[0, 2, 1], [0, 3, 2]])
+    
+    return corners.reshape(-1, 3), ((4 * rows)[:, None, None] + first).reshape(-1, 3), np.repeat(key, 2)
+
+def get_cube_mesh(voxel_grid, color_by="Z-coordinate", level=0):
+    """Return (vertices, triangles, color per triangle, color title) of the merged cube faces, kept on the grid"""
+    meshes = getattr(voxel_grid, '_cube_meshes', None)
+    if meshes is None:
+        meshes = voxel_grid._cube_meshes = {}
+    if (level, color_by) not in meshes:
+        size = 1 << level
+        shape = -(-np.asarray(voxel_grid.shape) // size)
+        if level:
+            first, _ = get_voxel_octree(voxel_grid).cells(level)
+        else:
+            first = voxel_grid.sparse_indices
+        occupied = np.sort(np.ravel_multi_index((first >> level).T, shape))
+        exposed = get_exposed_voxels(voxel_grid, level)
+        
+        # Color by the cell centers, quantized so neighboring faces can merge
+        values, color_title = voxel_color_values(exposed + (size - 1) / 2, color_by)
+        low, span = values.min(), np.ptp(values) or 1.0
+        keys = np.round((values - low) / span * (CUBE_COLOR_LEVELS - 1)).astype(np.int64)
+        
+        vertices, triangles, triangle_keys = greedy_voxel_mesh(exposed >> level, shape, keys, occupied)
+        # Cell corners to voxel coordinates, where voxel centers sit on integers
+        meshes[(level, color_by)] = (vertices * size - 0.5, triangles,
+                                     low + triangle_keys * span / (CUBE_COLOR_LEVELS - 1), color_title)
+        get_voxel_cache().refresh(voxel_grid)
+    return meshes[(level, color_by)]
+
+def create_cube_visualization(voxel_grid, colormap="Viridis", color_by="Z-coordinate", opacity=0.8, level=0):
+    """Create 3D visualization of voxels as solid cubes, one Mesh3d of merged faces"""
+    if voxel_grid.filled_count == 0:
+        st.warning("No voxels found in the mesh")
+        return None
+    
+    vertices, triangles, intensity, color_title = get_cube_mesh(voxel_grid, color_by, level)
+    
+    fig = go.Figure(data=go.Mesh3d(
+        x=vertices[:, 0], y=vertices[:, 1], z=vertices[:, 2],
+        i=triangles[:, 0], j=triangles[:, 1], k=triangles[:, 2],
+        intensity=intensity,
+        intensitymode='cell',
+        colorscale=colormap,
+        colorbar=dict(title=color_title),
+        opacity=opacity,
+        flatshading=True,
+        hovertemplate=f'<b>Voxel face</b><br>X: %{{x}}<br>Y: %{{y}}<br>Z: %{{z}}<br>{color_title}: %{{intensity:.2f}}<extra></extra>'
     ))
     
-    # Update colorbar title
-    fig.update_coloraxes(colorbar_title=color_title)
+    if level:
+        cells = len(get_voxel_octree(voxel_grid).levels[level][0])
+        title = (f'Voxelized STL Model ({voxel_grid.filled_count:,} voxels shown as {cells:,} cells of '
+                 f'{1 << level}³ voxels, octree level {level}; {len(triangles):,} triangles)')
+    else:
+        title = f'Voxelized STL Model ({voxel_grid.filled_count:,} voxels as {len(triangles):,} triangles)'
+    return style_voxel_figure(fig, title)
+
+# Triangle budget of the isosurface view, and the most voxels unpacked per isosurface chunk
+ISOSURFACE_TRIANGLES = 400000
+ISOSURFACE_CHUNK_VOXELS = 1 << 24
+# Gaussian smoothing (in pooled cells) applied before extracting the isosurface, and its kernel radius
+ISOSURFACE_SMOOTHING = 1.0
+ISOSURFACE_HALO = 2
+# Marching cubes triangles per exposed voxel at step 1, for picking the step size
+ISOSURFACE_TRIANGLES_PER_VOXEL = 3.7
+
+def isosurface_step_size(voxel_grid, max_triangles=ISOSURFACE_TRIANGLES):
+    """Smallest step size whose predicted isosurface stays within max_triangles"""
+    # Triangles scale with surface area, so with the inverse square of the step
+    triangles = ISOSURFACE_TRIANGLES_PER_VOXEL * len(get_exposed_voxels(voxel_grid))
+    return max(int(np.ceil(np.sqrt(triangles / max_triangles))), 1)
+
+def voxel_planes(voxel_grid, start, stop):
+    """Dense occupancy of X planes start to stop; planes outside the grid are empty"""
+    data = np.zeros((stop - start,) + tuple(voxel_grid.shape[1:]), dtype=bool)
+    first, last = max(start, 0), min(stop, voxel_grid.shape[0])
+    if first < last:
+        if isinstance(voxel_grid, (SparseVoxelGrid, PackedVoxelGrid)):
+            data[first - start:last - start] = voxel_grid.unpack(first, last)
+        else:
+            data[first - start:last - start] = voxel_grid.matrix[first:last]
+    return data
+
+def _pooled_planes(voxel_grid, step, first, stop, margin):
+    """Yield blocks of pooled X planes first to stop, each cell the max of a step³ voxel block
     
+    Blocks are sized to unpack at most ISOSURFACE_CHUNK_VOXELS voxels; Y and Z get an
+    empty margin of pooled cells.
+    """
+    pooled_shape = -(-np.asarray(voxel_grid.shape[1:]) // step)
+    batch = max(ISOSURFACE_CHUNK_VOXELS // (step ** 3 * int(np.prod(pooled_shape))), 1)
+    for low in range(first, stop, batch):
+        high = min(low + batch, stop)
+        planes = voxel_planes(voxel_grid, low * step, high * step)
+        planes = np.pad(planes, [(0, 0)] + [(0, n * step - size) for n, size in
+                                            zip(pooled_shape, voxel_grid.shape[1:])])
+        pooled = planes.reshape(high - low, step, pooled_shape[0], step, pooled_shape[1], step).any(axis=(1, 3, 5))
+        yield np.pad(pooled, [(0, 0), (margin, margin), (margin, margin)])
+
+def voxel_isosurface(voxel_grid, step_size=1):
+    """Smoothed marching cubes surface of a voxel grid, as (vertices in voxel coordinates, faces)
+    
+    Each step_size³ block is max-pooled into one cell, so thin shells survive coarse steps.
+    Pooled planes stream through in X chunks that share their boundary plane and carry a halo
+    wide enough for the smoothing, so the chunk surfaces meet exactly and weld into one mesh.
+    """
+    step, halo = step_size, ISOSURFACE_HALO
+    # Sample planes -pad to last, with an empty margin so the surface closes at the grid border
+    pad = halo + 1
+    last = int(-(-voxel_grid.shape[0] // step)) + pad - 1
+    plane_cells = int(np.prod(-(-np.asarray(voxel_grid.shape[1:]) // step) + 2 * pad))
+    chunk = max(ISOSURFACE_CHUNK_VOXELS // plane_cells - 2 * halo, 1)
+    
+    soups = []
+    first = -pad
+    buffer, buffer_start = None, -pad - halo
+    for block in _pooled_planes(voxel_grid, step, -pad - halo, last + halo + 1, pad):
+        buffer = block if buffer is None else np.concatenate([buffer, block])
+        # Extract every chunk whose planes, halo included, have all arrived
+        while first < last and buffer_start + len(buffer) > min(first + chunk, last) + halo:
+            stop = min(first + chunk, last)
+            window = buffer[first - halo - buffer_start:stop + halo + 1 - buffer_start].astype(np.float32)
+            volume = ndimage.gaussian_filter(window, ISOSURFACE_SMOOTHING, truncate=halo / ISOSURFACE_SMOOTHING)
+            volume = volume[halo:halo + stop - first + 1]
+            if volume.max() > 0.5:
+                vertices, faces, _, _ = measure.marching_cubes(volume, 0.5)
+                # Pooled cell indices to voxel coordinates, where voxel centers sit on integers
+                vertices = (vertices + [first, -pad, -pad]) * step + (step - 1) / 2
+                soups.append(vertices[faces])
+            
+            first = stop
+            buffer = buffer[first - halo - buffer_start:]
+            buffer_start = first - halo
+    
+    if not soups:
+        return np.empty((0, 3)), np.empty((0, 3), dtype=np.int64)
+    # Chunks compute identical vertices on their shared planes, so exact welding closes the seams
+    return weld_vertices(np.concatenate(soups))
+
+def get_isosurface(voxel_grid, step_size=1):
+    """Isosurface of a voxel grid at a step size, kept on the grid"""
+    surfaces = getattr(voxel_grid, '_isosurfaces', None)
+    if surfaces is None:
+        surfaces = voxel_grid._isosurfaces = {}
+    if step_size not in surfaces:
+        surfaces[step_size] = voxel_isosurface(voxel_grid, step_size)
+        get_voxel_cache().refresh(voxel_grid)
+    return surfaces[step_size]
+
+def create_isosurface_visualization(voxel_grid, colormap="Viridis", color_by="Z-coordinate", opacity=0.8, level=0):
+    """Create 3D visualization of a smooth marching cubes surface through the voxels"""
+    if voxel_grid.filled_count == 0:
+        st.warning("No voxels found in the mesh")
+        return None
+    
+    # Coarser detail levels never step finer than their octree cells
+    step_size = max(isosurface_step_size(voxel_grid), 1 << level)
+    vertices, faces = get_isosurface(voxel_grid, step_size)
+    color_values, color_title = voxel_color_values(vertices, color_by)
+    
+    fig = go.Figure(data=go.Mesh3d(
+        x=vertices[:, 0], y=vertices[:, 1], z=vertices[:, 2],
+        i=faces[:, 0], j=faces[:, 1], k=faces[:, 2],
+        intensity=color_values,
+        colorscale=colormap,
+        colorbar=dict(title=color_title),
+        opacity=opacity,
+        hovertemplate=f'<b>Surface</b><br>X: %{{x:.1f}}<br>Y: %{{y:.1f}}<br>Z: %{{z:.1f}}<br>{color_title}: %{{intensity:.2f}}<extra></extra>'
+    ))
+    
+    return style_voxel_figure(fig, f'Voxelized STL Model ({voxel_grid.filled_count:,} voxels as '
+                                   f'{len(faces):,} isosurface triangles, step {step_size})')
+
+def style_voxel_figure(fig, title):
+    """Apply the shared title, scene and size of the 3D voxel views"""
     fig.update_layout(
-        title=f'Voxelized STL Model ({len(x):,} voxels)',
+        title=title,
         scene=dict(
             xaxis_title='X Coordinate',
             yaxis_title='Y Coordinate',
@@ -118,34 +1981,117 @@ def create_voxel_visualization(voxel_grid, colormap="Viridis", color_by="Z-coord
         paper_bgcolor='white',
         plot_bgcolor='white'
     )
-    
     return fig
 
-def create_slice_visualization(voxel_grid, slice_axis='z', slice_index=None, colormap="Viridis"):
+def create_voxel_visualization(voxel_grid, colormap="Viridis", color_by="Z-coordinate", marker_size=4, opacity=0.8,
+                               level=0, surface_only=True, render='Markers', max_points=MAX_VIEW_POINTS):
+    """Create 3D visualization of voxels with customizable colormaps"""
+    if render == 'Isosurface':
+        return create_isosurface_visualization(voxel_grid, colormap, color_by, opacity, level)
+    
+    # Over the point budget, coarsen to a pooled level, growing markers to cover their cells
+    if max_points and voxel_grid.filled_count > max_points:
+        view_level = points_level(voxel_grid, max_points, level, surface_only or render == 'Cubes')
+        marker_size *= 1 << (view_level - level)
+        level = view_level
+    
+    if render == 'Cubes':
+        return create_cube_visualization(voxel_grid, colormap, color_by, opacity, level)
+    
+    # Get filled voxel positions, or the first voxels of occupied octree cells at a coarser level;
+    # interior ones are hidden behind the surface, so by default only exposed ones are drawn
+    if surface_only:
+        filled_positions = get_exposed_voxels(voxel_grid, level)
+    elif level:
+        filled_positions, _ = get_voxel_octree(voxel_grid).cells(level)
+    else:
+        filled_positions = voxel_grid.sparse_indices
+    total = len(get_voxel_octree(voxel_grid).levels[level][0]) if level else voxel_grid.filled_count
+    # Coarse cells carry their filled voxel count for the hover label
+    customdata = get_voxel_octree(voxel_grid).counts(filled_positions, level) if level else None
+    if level:
+        filled_positions = filled_positions + ((1 << level) - 1) / 2
+    
+    if len(filled_positions) == 0:
+        st.warning("No voxels found in the mesh")
+        return None
+    
+    x, y, z = filled_positions[:, 0], filled_positions[:, 1], filled_positions[:, 2]
+    
+    # Calculate color values based on selection
+    color_values, color_title = voxel_color_values(filled_positions, color_by)
+    
+    # Hover labels come from a template filled in by the browser; past HOVER_MAX_POINTS
+    # the browser's hover search gets slow, so hover is switched off
+    hovertemplate = (f'<b>{"Cell" if level else "Voxel"}</b><br>X: %{{x}}<br>Y: %{{y}}<br>Z: %{{z}}<br>'
+                     f'{color_title}: %{{marker.color:.2f}}'
+                     f'{"<br>Filled voxels: %{customdata}" if level else ""}<extra></extra>')
+    hover = len(filled_positions) <= HOVER_MAX_POINTS
+    
+    fig = go.Figure(data=go.Scatter3d(
+        x=x, y=y, z=z,
+        mode='markers',
+        marker=dict(
+            size=marker_size,
+            color=color_values,
+            colorscale=colormap,
+            opacity=opacity,
+            showscale=True,
+            line=dict(width=0.5, color='rgba(0,0,0,0.1)')
+        ),
+        customdata=customdata,
+        hovertemplate=hovertemplate if hover else None,
+        hoverinfo=None if hover else 'skip'
+    ))
+    
+    # Update colorbar title
+    fig.update_coloraxes(colorbar_title=color_title)
+    
+    shown = f'{len(x):,} surface of {total:,}' if surface_only else f'{len(x):,}'
+    hover_note = '' if hover else '; hover off'
+    if level:
+        title = (f'Voxelized STL Model ({voxel_grid.filled_count:,} voxels shown as {shown} cells '
+                 f'of {1 << level}³ voxels, octree level {level}{hover_note})')
+    else:
+        title = f'Voxelized STL Model ({shown} voxels{hover_note})'
+    
+    return style_voxel_figure(fig, title)
+
+def create_slice_visualization(voxel_grid, slice_axis='z', slice_index=None, colormap="Viridis", level=0):
     """Create 2D slice visualization of voxels with customizable colormaps"""
-    volume = voxel_grid.matrix
+    axis = {'x': 0, 'y': 1, 'z': 2}[slice_axis]
     
     if slice_index is None:
-        slice_index = volume.shape[{'x': 0, 'y': 1, 'z': 2}[slice_axis]] // 2
+        slice_index = voxel_grid.shape[axis] // 2
+    
+    # Coarser levels show occupied octree cells crossing the plane, placed at their centers
+    coordinates = {}
+    if level:
+        slice_data = get_voxel_octree(voxel_grid).slice(axis, slice_index, level)
+        coordinates = {'y': np.arange(slice_data.shape[0]) * (1 << level) + ((1 << level) - 1) / 2,
+                       'x': np.arange(slice_data.shape[1]) * (1 << level) + ((1 << level) - 1) / 2}
+    else:
+        slice_data = voxel_slice(voxel_grid, axis, slice_index)
     
     if slice_axis == 'x':
-        slice_data = volume[slice_index, :, :]
         title = f'X-slice at index {slice_index}'
         labels = {'x': 'Y Coordinate', 'y': 'Z Coordinate'}
     elif slice_axis == 'y':
-        slice_data = volume[:, slice_index, :]
         title = f'Y-slice at index {slice_index}'
         labels = {'x': 'X Coordinate', 'y': 'Z Coordinate'}
     else:  # z-axis
-        slice_data = volume[:, :, slice_index]
         title = f'Z-slice at index {slice_index}'
         labels = {'x': 'X Coordinate', 'y': 'Y Coordinate'}
     
+    if level:
+        title += f' (octree level {level})'
+    
     fig = px.imshow(slice_data, 
                     title=title,
                     color_continuous_scale=colormap,
                     aspect='equal',
-                    labels=labels)
+                    labels=labels,
+                    **coordinates)
     
     fig.update_layout(
         title=dict(x=0.5, font=dict(size=16)),
@@ -160,6 +2106,53 @@ def create_slice_visualization(voxel_grid, slice_axis='z', slice_index=None, col
     
     return fig
 
+# Expensive mesh statistics computed in the background: (label, attribute, format)
+MESH_STATISTICS = [
+    ("Surface Area", 'area', "{:.4f}"),
+    ("Volume", 'volume', "{:.4f}"),
+    ("Watertight", 'is_watertight', "{}"),
+    ("Euler Number", 'euler_number', "{}"),
+]
+
+@st.cache_resource
+def get_statistics_executor():
+    """Thread pool shared by all sessions for background mesh statistics"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix='mesh-statistics')
+
+def get_mesh_statistics(mesh_obj):
+    """Return futures for the expensive statistics, submitting them once per mesh"""
+    futures = mesh_obj.metadata.get('statistics')
+    if futures is None:
+        executor = get_statistics_executor()
+        futures = {attribute: executor.submit(getattr, mesh_obj, attribute)
+                   for _, attribute, _ in MESH_STATISTICS}
+        mesh_obj.metadata['statistics'] = futures
+    return futures
+
+def _mesh_statistics_panel(mesh_obj, pending=False):
+    """Write each statistic, or a placeholder while it is still being computed"""
+    futures = get_mesh_statistics(mesh_obj)
+    if pending and all(future.done() for future in futures.values()):
+        # run_every is only decided on a full run, so rerun the app to stop polling
+        st.rerun()
+    for label, attribute, fmt in MESH_STATISTICS:
+        future = futures[attribute]
+        if not future.done():
+            st.write(f"**{label}:** _computing..._")
+        elif future.exception() is not None:
+            st.write(f"**{label}:** unavailable")
+        else:
+            st.write(f"**{label}:** {fmt.format(future.result())}")
+
+def display_mesh_statistics(mesh_obj):
+    """Show background statistics, refreshing the panel until they have all arrived"""
+    futures = get_mesh_statistics(mesh_obj)
+    pending = not all(future.done() for future in futures.values())
+    if not pending:
+        # The statistics leave edge and area arrays in trimesh's caches
+        get_mesh_cache().refresh(mesh_obj)
+    st.fragment(_mesh_statistics_panel, run_every=1.0 if pending else None)(mesh_obj, pending)
+
 def display_mesh_info(mesh_obj, voxel_grid):
     """Display information about the mesh and voxelization"""
     col1, col2 = st.columns(2)
@@ -168,8 +2161,12 @@ def display_mesh_info(mesh_obj, voxel_grid):
         st.subheader("Mesh Information")
         st.write(f"**Vertices:** {len(mesh_obj.vertices)}")
         st.write(f"**Faces:** {len(mesh_obj.faces)}")
-        st.write(f"**Volume:** {mesh_obj.volume:.4f}")
-        st.write(f"**Surface Area:** {mesh_obj.area:.4f}")
+        display_mesh_statistics(mesh_obj)
+        
+        weld = mesh_obj.metadata.get('weld')
+        if weld is not None:
+            st.write(f"**Welding:** merged {weld['merged']:,} of {weld['corners']:,} corners "
+                     f"in {weld['seconds'] * 1000:.1f} ms (tolerance {weld['tolerance']:g})")
         
         bounds = mesh_obj.bounds
         st.write(f"**Bounding Box:**")
@@ -179,11 +2176,11 @@ def display_mesh_info(mesh_obj, voxel_grid):
     
     with col2:
         st.subheader("Voxel Information")
-        voxel_count = np.sum(voxel_grid.matrix)
-        total_voxels = np.prod(voxel_grid.matrix.shape)
+        voxel_count = voxel_grid.filled_count
+        total_voxels = np.prod(voxel_grid.shape)
         fill_ratio = voxel_count / total_voxels
         
-        st.write(f"**Grid Size:** {voxel_grid.matrix.shape}")
+        st.write(f"**Grid Size:** {tuple(voxel_grid.shape)}")
         st.write(f"**Filled Voxels:** {int(voxel_count)}")
         st.write(f"**Total Voxels:** {total_voxels}")
         st.write(f"**Fill Ratio:** {fill_ratio:.4f}")
@@ -197,9 +2194,156 @@ def display_mesh_info(mesh_obj, voxel_grid):
             # Calculate pitch from bounds and grid size
             bounds = mesh_obj.bounds
             max_dimension = max(bounds[1] - bounds[0])
-            estimated_pitch = max_dimension / max(voxel_grid.matrix.shape)
+            estimated_pitch = max_dimension / max(voxel_grid.shape)
             st.write(f"**Estimated Voxel Pitch:** {estimated_pitch:.4f}")
 
+# How often the script checks on a running progressive job; each check touches the UI,
+# which is where Streamlit acts on a click
+PROGRESSIVE_POLL_SECONDS = 0.2
+
+@st.cache_resource
+def get_progressive_executor():
+    """Thread pool shared by all sessions for progressive voxelization jobs"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix='progressive')
+
+def _run_progressive_job(job, mesh_obj, resolution, options):
+    """Background job: keep the latest pass in job['latest'] until the last pass or a cancel
+    
+    Warnings and errors go to job['messages'], since st calls from this thread are dropped.
+    """
+    _job_messages.messages = job['messages']
+    try:
+        for pass_resolution, voxel_grid in voxelize_progressive(mesh_obj, resolution, **options):
+            job['latest'] = (pass_resolution, voxel_grid)
+            if job['cancelled']:
+                return
+    finally:
+        _job_messages.messages = None
+
+def show_job_messages(job):
+    """Show a background job's recorded messages once each; returns whether any was an error"""
+    messages = list(dict.fromkeys(job['messages']))
+    for kind, message in messages:
+        getattr(st, kind)(message)
+    return any(kind == 'error' for kind, _ in messages)
+
+def display_progressive_voxelization(mesh_obj, resolution, **options):
+    """Voxelize in coarse-to-fine passes, previewing each pass until it finishes or the user accepts one
+    
+    The passes run on a background thread while the script polls them, so Accept takes
+    effect within a poll interval, even during the final, most expensive pass.
+    """
+    key = voxel_cache_key(mesh_obj, resolution, **options)
+    if key in get_voxel_cache():
+        return voxelize_mesh_cached(mesh_obj, resolution, **options)
+    
+    # One job per settings; a job for other settings is told to stop after its current pass
+    job = st.session_state.get('progressive')
+    if job is None or job['key'] != key:
+        if job is not None:
+            job['cancelled'] = True
+        job = {'key': key, 'latest': None, 'accepted': False, 'cancelled': False, 'messages': []}
+        job['future'] = get_progressive_executor().submit(_run_progressive_job, job, mesh_obj, resolution, options)
+        st.session_state['progressive'] = job
+    
+    # An accepted pass stands in for the full result until the settings change
+    accept_slot = st.empty()
+    accepted = False
+    if not job['accepted'] and not job['future'].done():
+        accepted = accept_slot.button("Accept Current Result", help="Stop refining and keep the latest pass")
+    if (job['accepted'] or accepted) and job['latest'] is not None:
+        job['accepted'] = job['cancelled'] = True
+        show_job_messages(job)
+        accept_slot.info(f"Showing the accepted resolution {job['latest'][0]} pass; "
+                         f"change any setting to voxelize again")
+        return job['latest'][1]
+    
+    status = st.empty()
+    preview = st.empty()
+    shown = None
+    start = time.perf_counter()
+    while not job['future'].done():
+        latest = job['latest']
+        if latest is not None and latest[0] != shown:
+            shown, voxel_grid = latest
+            with preview.container():
+                col1, col2 = st.columns([2, 1])
+                fig_3d = create_voxel_visualization(voxel_grid)
+                if fig_3d:
+                    col1.plotly_chart(fig_3d, use_container_width=True, key=f"progressive_3d_{shown}")
+                col2.plotly_chart(create_slice_visualization(voxel_grid), use_container_width=True,
+                                  key=f"progressive_slice_{shown}")
+        done = f"Resolution {shown} pass done, refining" if shown else "Voxelizing"
+        status.caption(f"{done} to {resolution}... ({time.perf_counter() - start:.0f} s)")
+        time.sleep(PROGRESSIVE_POLL_SECONDS)
+    
+    accept_slot.empty()
+    status.empty()
+    preview.empty()
+    
+    failed = show_job_messages(job)
+    if job['future'].exception() is not None:
+        st.error(f"Error voxelizing mesh: {job['future'].exception()}")
+        return None
+    latest = job['latest']
+    if latest is None or latest[0] != resolution:
+        if not failed:
+            st.error("Error voxelizing mesh: the final pass did not finish")
+        return None
+    return latest[1]
+
+def display_batch_mode():
+    """Upload many mesh files and voxelize them in parallel, reporting throughput"""
+    uploaded_files = st.file_uploader("Choose mesh files", type=MESH_FILE_TYPES, accept_multiple_files=True)
+    
+    st.sidebar.subheader("Batch Settings")
+    resolution = st.sidebar.slider("Resolution", 10, 200, 50,
+                                   help="Higher resolution = more voxels = longer processing time")
+    weld_tolerance = st.sidebar.number_input(
+        "Weld Tolerance", min_value=0.0, value=WELD_TOLERANCE, format="%.2e",
+        help="Merge triangle corners closer than this distance (0 = identical corners only)")
+    engine = st.sidebar.selectbox("Voxelization Engine", VOXEL_ENGINES, help=VOXEL_ENGINE_HELP)
+    mode = st.sidebar.selectbox("Voxelization Mode", VOXEL_MODES, help=VOXEL_MODE_HELP)
+    max_workers = int(st.sidebar.number_input("Worker Processes", min_value=1, value=os.cpu_count() or 1, step=1))
+    
+    if not uploaded_files:
+        st.info("Upload one or more mesh files (STL, PLY or OBJ) to process them as a batch")
+        return
+    
+    if st.button(f"Process {len(uploaded_files)} Files"):
+        # Views of the uploads, copied only when their worker picks them up
+        items = [(uploaded_file.name, _upload_buffer(uploaded_file)) for uploaded_file in uploaded_files]
+        progress = st.progress(0.0)
+        metrics = st.empty()
+        table = st.empty()
+        
+        rows = []
+        total_triangles = 0
+        start = time.perf_counter()
+        for result in voxelize_batch(items, resolution, weld_tolerance, max_workers, engine=engine, mode=mode):
+            elapsed = time.perf_counter() - start
+            total_triangles += result.get('triangles', 0)
+            rows.append({
+                'File': result['name'],
+                'Triangles': result.get('triangles'),
+                'Filled Voxels': result.get('filled_voxels'),
+                'Grid Size': str(result.get('grid_shape', '')),
+                'Seconds': result.get('seconds'),
+                'Error': result.get('error', ''),
+            })
+            
+            progress.progress(len(rows) / len(items))
+            with metrics.container():
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Meshes Done", f"{len(rows)} / {len(items)}")
+                col2.metric("Meshes/s", f"{len(rows) / elapsed:.2f}")
+                col3.metric("Triangles/s", f"{total_triangles / elapsed:,.0f}")
+            table.dataframe(rows, use_container_width=True)
+        
+        st.session_state['batch_rows'] = rows
+    elif 'batch_rows' in st.session_state:
+        st.dataframe(st.session_state['batch_rows'], use_container_width=True)
+
 def main():
     st.set_page_config(
         page_title="Voxelize",
@@ -215,27 +2359,113 @@ def main():
     except:
         st.warning("Image 'image.png' not found in the current directory")
     
-    st.markdown("Upload an STL file to visualize it as voxels")
+    st.markdown("Upload an STL, PLY or OBJ file to visualize it as voxels")
     
     # Sidebar controls
     st.sidebar.header("Controls")
     
-    uploaded_file = st.file_uploader("Choose an STL file", type=['stl'])
+    if st.sidebar.checkbox("Batch Mode", help="Process many mesh files at once in parallel"):
+        display_batch_mode()
+        return
+    
+    uploaded_file = st.file_uploader("Choose a mesh file (STL, PLY or OBJ)", type=MESH_FILE_TYPES)
     
     if uploaded_file is not None:
+        # Loading controls
+        st.sidebar.subheader("Loading Settings")
+        weld_tolerance = st.sidebar.number_input(
+            "Weld Tolerance", min_value=0.0, value=WELD_TOLERANCE, format="%.2e",
+            help="Merge triangle corners closer than this distance (0 = identical corners only)")
+        
         # Load mesh
-        with st.spinner("Loading STL file..."):
-            mesh_obj = load_stl_file(uploaded_file)
+        with st.spinner("Loading mesh file..."):
+            mesh_obj = load_mesh_cached(uploaded_file, weld_tolerance)
         
         if mesh_obj is not None:
+            # Start the background statistics now, so estimates below never wait for them
+            get_mesh_statistics(mesh_obj)
+            
             # Voxelization controls
             st.sidebar.subheader("Voxelization Settings")
-            resolution = st.sidebar.slider("Resolution", 10, 200, 50, 
-                                         help="Higher resolution = more voxels = longer processing time")
+            engine = st.sidebar.selectbox("Voxelization Engine", VOXEL_ENGINES, help=VOXEL_ENGINE_HELP)
+            storage = 'dense'
+            if engine == 'native':
+                storage = st.sidebar.selectbox("Storage", VOXEL_STORAGES, help=VOXEL_STORAGE_HELP)
+            # Sparse grids hold surface shells only
+            modes = VOXEL_MODES if storage != 'sparse' else ['surface']
+            mode = st.sidebar.selectbox("Voxelization Mode", modes, help=VOXEL_MODE_HELP)
+            
+            grid_size = st.sidebar.selectbox("Grid Size From", GRID_SIZE_MODES,
+                                             help="Set the resolution directly, or let a budget pick it")
+            if grid_size == 'Resolution':
+                resolution = st.sidebar.slider("Resolution", 10, MAX_RESOLUTION[storage], 50, 
+                                             help="Higher resolution = more voxels = longer processing time")
+            else:
+                max_voxels = max_mb = None
+                if grid_size == 'Voxel budget':
+                    max_voxels = st.sidebar.number_input("Target Filled Voxels", min_value=1000, value=1000000,
+                                                         step=100000)
+                else:
+                    max_mb = st.sidebar.number_input("Memory Budget (MB)", min_value=1.0, value=64.0, step=16.0,
+                                                     help="Memory of the finished voxel grid")
+                calibrate = st.sidebar.checkbox(
+                    "Calibrate Estimate", value=False,
+                    help=f"Voxelize at resolution {CALIBRATION_RESOLUTION} first to fit the estimate to this mesh")
+                budget = budget_resolution(mesh_obj, max_voxels, max_mb, mode, storage, calibrate, engine=engine)
+                resolution = min(max(budget, 10), MAX_RESOLUTION[storage])
+                pitch = max(mesh_obj.extents) / resolution
+                capped = f"; capped by the {storage} storage limit" if resolution < budget else ""
+                st.sidebar.caption(f"Resolution {resolution} (pitch {pitch:.4g}), "
+                                   f"about {estimate_voxel_count(mesh_obj, pitch, mode):,.0f} filled voxels{capped}")
+            progressive = st.sidebar.checkbox(
+                "Progressive Preview", value=True,
+                help="Show coarse passes while the full resolution is computed, and accept one early")
+            workers = 1
+            refine = False
+            if engine == 'native' and storage == 'dense':
+                workers = int(st.sidebar.number_input(
+                    "Worker Processes", min_value=1, value=1, step=1,
+                    help="Split the grid into bricks and voxelize them in parallel processes"))
+                refine = workers == 1 and not progressive and st.sidebar.checkbox(
+                    "Refine From Previous Grid", value=False,
+                    help="When the resolution increases, re-test only voxels near the previous grid's surface")
+            
+            # Reuse the last grid of this mesh and mode when refining to a higher resolution
+            previous = None
+            previous_key = (mesh_content_hash(mesh_obj), mode)
+            last = st.session_state.get('previous_voxel_grid')
+            if refine and last is not None and last[0] == previous_key:
+                previous = last[1]
+            
+            # Predict the cost up front, and refuse runs beyond the configured limits
+            cost = estimate_voxelization_cost(mesh_obj, resolution, mode, engine, storage)
+            st.sidebar.caption(f"Predicted: {cost['seconds']:.1f} s, {cost['peak_mb']:,.0f} MB peak, "
+                               f"about {cost['voxels']:,.0f} filled voxels")
+            refused = cost['seconds'] > COST_MAX_SECONDS or cost['peak_mb'] > COST_MAX_MB
+            if refused:
+                st.error(f"Predicted cost is over the limit of {COST_MAX_SECONDS:g} s or {COST_MAX_MB:g} MB; "
+                         f"lower the resolution to voxelize")
+            elif cost['seconds'] > COST_WARN_SECONDS or cost['peak_mb'] > COST_WARN_MB:
+                st.warning(f"Voxelization is predicted to take {cost['seconds']:.0f} s and "
+                           f"{cost['peak_mb']:,.0f} MB of memory")
             
             # Voxelize mesh
-            with st.spinner("Voxelizing mesh..."):
-                voxel_grid = voxelize_mesh(mesh_obj, resolution)
+            start = time.perf_counter()
+            if refused:
+                voxel_grid = None
+            elif progressive:
+                voxel_grid = display_progressive_voxelization(mesh_obj, resolution, engine=engine, mode=mode,
+                                                              workers=workers, storage=storage)
+            else:
+                with st.spinner("Voxelizing mesh..."):
+                    voxel_grid = voxelize_mesh_cached(mesh_obj, resolution, engine=engine, mode=mode,
+                                                      workers=workers, storage=storage, previous=previous)
+            elapsed = time.perf_counter() - start
+            
+            if voxel_grid is not None and storage == 'dense':
+                if previous is not None and previous._pitch > voxel_grid._pitch:
+                    st.sidebar.caption(f"Refined from a {'x'.join(map(str, previous.shape))} grid in {elapsed:.2f} s")
+                st.session_state['previous_voxel_grid'] = (previous_key, voxel_grid)
             
             if voxel_grid is not None:
                 # Display mesh and voxel information
@@ -275,17 +2505,34 @@ def main():
                     help="Choose what property to use for coloring voxels"
                 )
                 
+                render = st.sidebar.selectbox("Render As", RENDER_MODES, help=RENDER_MODE_HELP)
+                
                 # Advanced visualization options
                 with st.sidebar.expander("Advanced Options"):
                     opacity = st.slider("Opacity", 0.1, 1.0, 0.8, 0.1)
                     marker_size = st.slider("Marker Size", 1, 10, 4, 1)
+                    max_points = int(st.number_input(
+                        "Max Points", min_value=1000, value=MAX_VIEW_POINTS, step=50000,
+                        help="Most markers sent to the browser; larger grids are max-pooled into coarser "
+                             "cells drawn with bigger markers"))
+                    show_interior = st.checkbox(
+                        "Show Interior Voxels", value=False,
+                        help="Also draw voxels with no empty face neighbor, which the surface hides")
+                
+                # Large grids open at a coarse octree level; full detail only on request
+                octree = get_voxel_octree(voxel_grid)
+                detail_level = st.sidebar.slider(
+                    "Detail Level", 0, octree.depth, octree.view_level(OCTREE_VIEW_CELLS),
+                    help="Octree level shown in the 3D view and slices: 0 is full detail, "
+                         "each level up merges 2x2x2 cells")
                 
                 # Main visualization
                 st.subheader("3D Voxel Visualization")
                 
                 with st.spinner("Creating 3D visualization..."):
                     fig_3d = create_voxel_visualization(
-                        voxel_grid, selected_colormap, color_by, marker_size, opacity
+                        voxel_grid, selected_colormap, color_by, marker_size, opacity, detail_level,
+                        not show_interior, render, max_points
                     )
                 
                 if fig_3d:
@@ -299,7 +2546,7 @@ def main():
                 
                 with col1:
                     slice_axis = st.selectbox("Slice Axis", ['x', 'y', 'z'])
-                    max_slice = voxel_grid.matrix.shape[{'x': 0, 'y': 1, 'z': 2}[slice_axis]] - 1
+                    max_slice = voxel_grid.shape[{'x': 0, 'y': 1, 'z': 2}[slice_axis]] - 1
                     slice_index = st.slider(f"{slice_axis.upper()}-slice Index", 0, max_slice, max_slice // 2)
                     
                     # Slice colormap (can be different from 3D)
@@ -312,7 +2559,7 @@ def main():
                 
                 with col2:
                     fig_slice = create_slice_visualization(
-                        voxel_grid, slice_axis, slice_index, slice_colormap
+                        voxel_grid, slice_axis, slice_index, slice_colormap, detail_level
                     )
                     st.plotly_chart(fig_slice, use_container_width=True)
                 
@@ -323,11 +2570,25 @@ def main():
                 col1, col2, col3 = st.columns(3)
                 
                 with col1:
-                    if st.button("Download Voxel Data (NPY)"):
+                    if isinstance(voxel_grid, (SparseVoxelGrid, PackedVoxelGrid)):
+                        # Sparse grids export their filled indices and packed grids their bytes rather than
+                        # a dense array, with the shape and placement needed to read them back
+                        packed = isinstance(voxel_grid, PackedVoxelGrid)
+                        if st.button("Download Voxel Data (NPZ)"):
+                            buffer = io.BytesIO()
+                            write_voxel_npz(buffer, voxel_grid)
+                            buffer.seek(0)
+                            
+                            st.download_button(
+                                label="Download Packed Voxels" if packed else "Download Sparse Voxels",
+                                data=buffer,
+                                file_name=f"{uploaded_file.name[:-4]}_voxels{'_packed' if packed else ''}.npz",
+                                mime="application/octet-stream"
+                            )
+                    elif st.button("Download Voxel Data (NPY)"):
                         voxel_data = voxel_grid.matrix.astype(np.uint8)
                         
                         # Create download
-                        import io
                         buffer = io.BytesIO()
                         np.save(buffer, voxel_data)
                         buffer.seek(0)
@@ -341,7 +2602,7 @@ def main():
                 
                 with col2:
                     if st.button("Download Coordinates (CSV)"):
-                        filled_positions = np.argwhere(voxel_grid.matrix)
+                        filled_positions = voxel_grid.sparse_indices
                         
                         import pandas as pd
                         df = pd.DataFrame(filled_positions, columns=['X', 'Y', 'Z'])
@@ -353,13 +2614,15 @@ def main():
                             file_name=f"{uploaded_file.name[:-4]}_coordinates.csv",
                             mime="text/csv"
                         )
+        
+        display_cache_info()
     else:
-        st.info("Upload an STL file to get started!")
+        st.info("Upload an STL, PLY or OBJ file to get started!")
         
         # Show example/demo information
         with st.expander("How to use this app"):
             st.markdown("""
-            1. **Upload an STL file** using the file uploader above
+            1. **Upload an STL, PLY or OBJ file** using the file uploader above
             2. **Adjust the resolution** in the sidebar (higher = more detailed but slower)
             3. **Explore the 3D visualization** with different color schemes
             4. **View 2D slices** to analyze internal structure